@@ -0,0 +1,124 @@
+import os, json, time, sqlite3, zipfile, tempfile, itertools
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import genanki
+
+
+def get_card_ords(model: "genanki.Model", fields: list[str]) -> list[int]:
+    """
+    genanki.Note._front_back_cards と同じ規則で、生成されるカードの ord
+    """
+    ords = []
+    for card_ord, any_or_all, required_field_ords in model._req:
+        op = any if any_or_all == "any" else all
+        if op(fields[i] for i in required_field_ords):
+            ords.append(card_ord)
+    return ords
+
+
+def write_collection(
+    db_path: str,
+    model: "genanki.Model",
+    decks: list["genanki.Deck"],
+    rows: Iterable[tuple[int, str, list[str]]],
+    timestamp: float,
+) -> int:
+    """
+    genanki と同じスキーマ・内容の collection.anki2 を書き出す（ノート数を返す）
+
+    rows は (deck_id, guid, fields) の iterable。ノートとカードは一つの
+    トランザクションで executemany にまとめて挿入する。
+    """
+    from genanki.apkg_col import APKG_COL
+    from genanki.apkg_schema import APKG_SCHEMA
+
+    mod = int(timestamp)
+    id_gen = itertools.count(int(timestamp * 1000))
+    sort_index = model.sort_field_index
+
+    notes = []
+    cards = []
+    for deck_id, guid, fields in rows:
+        note_id = next(id_gen)
+        notes.append((
+            note_id, guid, model.model_id, mod, -1, "  ",
+            "\x1f".join(fields), fields[sort_index], 0, 0, "",
+        ))
+        for card_ord in get_card_ords(model, fields):
+            cards.append((
+                next(id_gen), note_id, deck_id, card_ord, mod, -1,
+                0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, "",
+            ))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        # 一時ファイルなので、ジャーナルも同期も要らない
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.executescript(APKG_SCHEMA)
+        conn.executescript(APKG_COL)
+
+        decks_json, models_json = conn.execute("SELECT decks, models FROM col").fetchone()
+        decks_dict = json.loads(decks_json)
+        for deck in decks:
+            decks_dict[str(deck.deck_id)] = deck.to_json()
+        models = json.loads(models_json)
+        models[str(model.model_id)] = model.to_json(timestamp, decks[-1].deck_id)
+
+        with conn:
+            conn.execute("UPDATE col SET decks = ?, models = ?", (json.dumps(decks_dict), json.dumps(models)))
+            conn.executemany("INSERT INTO notes VALUES(?,?,?,?,?,?,?,?,?,?,?)", notes)
+            conn.executemany("INSERT INTO cards VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", cards)
+    finally:
+        conn.close()
+
+    return len(notes)
+
+
+def write_package(
+    file_path: str,
+    model: "genanki.Model",
+    decks: list["genanki.Deck"],
+    rows: Iterable[tuple[int, str, list[str]]],
+    media: list[str],
+    timestamp: float | None = None,
+) -> int:
+    """
+    .apkg を書き出す（ノート数を返す）
+
+    collection.anki2 だけを deflate し、圧縮済みのメディア（webm, webp）は
+    ZIP_STORED のまま一つずつ zip に流し込む。一時ファイルに書いてから置き換える。
+    """
+    if timestamp is None:
+        timestamp = time.time()
+
+    out_dir = os.path.dirname(file_path) or "."
+    fd, db_path = tempfile.mkstemp(suffix=".anki2")
+    os.close(fd)
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".apkg.tmp")
+    os.close(fd)
+    try:
+        count = write_collection(db_path, model, decks, rows, timestamp)
+
+        with zipfile.ZipFile(tmp_path, "w") as outzip:
+            outzip.write(db_path, "collection.anki2", compress_type=zipfile.ZIP_DEFLATED)
+
+            media_json = {idx: os.path.basename(path) for idx, path in enumerate(media)}
+            outzip.writestr("media", json.dumps(media_json), compress_type=zipfile.ZIP_DEFLATED)
+
+            for idx, path in enumerate(media):
+                outzip.write(path, str(idx), compress_type=zipfile.ZIP_STORED)
+
+        # mkstemp は 0600 で作るので、普通に開いたファイルと同じ権限に戻す
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, file_path)
+    finally:
+        for path in (db_path, tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    return count
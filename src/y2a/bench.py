@@ -0,0 +1,387 @@
+import io, os, sys, json, time, random, shutil, tempfile, subprocess
+from contextlib import contextmanager, redirect_stdout
+from datetime import timedelta
+from importlib.util import find_spec
+from xml.sax.saxutils import escape
+from rich import print
+from rich.console import Console
+from rich.table import Table
+
+# `import y2a.cli` の累積 import 時間の上限（ms）
+IMPORT_BUDGET_MS = 300
+
+# CLI の起動時に読み込まれてはいけないモジュール
+LAZY_MODULES = (
+    "spacy",
+    "yt_dlp",
+    "genanki",
+    "imageio_ffmpeg",
+    "lxml",
+    "numpy",
+)
+
+# 高速モード（sentencizer）がフルモデルの文境界を再現すべき割合の下限
+SENTENCE_RECALL_MIN = 0.9
+
+# ステージ毎のベンチマークに使う合成字幕の語数
+SUITE_SIZES = (10_000, 100_000)
+# 合成動画の長さ（秒）
+SUITE_VIDEO_SECONDS = 60
+# ベースラインに対して許容する遅さ（倍率）と、誤差として無視する差（秒）
+SLOWDOWN_TOLERANCE = 1.5
+SLOWDOWN_MIN_SEC = 0.05
+
+# ステージ毎の絶対的な上限（秒）。ベースラインがなくても回帰を検出できるよう、
+# 手元の計測値の数倍にしてある。"@" 付きのステージは 10 万語あたり、
+# それ以外（extract / write_in_apkg）は合成動画 1 本あたり
+STAGE_BUDGETS = {
+    "parse_into_timedwords": 5.0,
+    "split_at_doc_boundaries": 1.0,
+    "split_at_doc_boundaries+grammar": 20.0,
+    "split_at_timestamp_boundaries": 0.5,
+    "split_at_speech_boundaries": 1.0,
+    "extract": 15.0,
+    "write_in_apkg": 1.0,
+}
+
+VOCAB = (
+    "the", "a", "to", "and", "of", "I", "you", "it", "that", "was", "we", "they",
+    "know", "like", "just", "really", "think", "going", "people", "because",
+    "when", "then", "so", "but", "if", "with", "about", "time", "right", "there",
+    "video", "thing", "good", "want", "make", "said", "actually", "little",
+)
+
+
+def measure_import_time(module: str = "y2a.cli") -> dict[str, int]:
+    """
+    `python -X importtime` を別プロセスで実行し、モジュール毎の累積時間（µs）を返す
+    """
+    # インストール先ではなく、この y2a と同じツリーを計る
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = [src_dir, os.environ.get("PYTHONPATH", "")]
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(p for p in paths if p)}
+
+    cmd = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True, env=env)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line.split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            continue
+        times[parts[2].strip()] = cumulative
+    return times
+
+
+def check_import_time(budget_ms: int = IMPORT_BUDGET_MS) -> bool:
+    times = measure_import_time("y2a.cli")
+    total_ms = times.get("y2a.cli", 0) / 1000
+    eager = [m for m in LAZY_MODULES if m in times]
+
+    ok = total_ms <= budget_ms and not eager
+    status = "[green]OK[/]" if ok else "[red]NG[/]"
+    print("[cyan][BENCH][/]", f"import y2a.cli: {total_ms:,.1f} ms (budget {budget_ms:,} ms)", status)
+    if eager:
+        print("[red][ERROR][/]", "Imported at startup:", ", ".join(eager))
+    return ok
+
+
+def show_import_time(limit: int = 15):
+    times = measure_import_time("y2a.cli")
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Module")
+    table.add_column("Cumulative (ms)", justify="right")
+    for module, us in sorted(times.items(), key=lambda kv: -kv[1])[:limit]:
+        table.add_row(module, f"{us / 1000:,.1f}")
+    Console().print(table)
+
+
+def get_sentence_ends(doc) -> set[int]:
+    """
+    文境界を文字位置の集合で返す（パイプライン間でトークン化が違っても比較できる）
+    """
+    from y2a.splitter import get_sentence_boundaries
+
+    return {doc[i].idx + len(doc[i]) for i in get_sentence_boundaries(doc)}
+
+
+def check_sentence_boundaries(subtitle_path: str, min_recall: float = SENTENCE_RECALL_MIN) -> bool:
+    """
+    高速モードとフルモデルで文境界を求め、所要時間と一致率を比べる
+    """
+    from y2a.parser import parse_into_word_store
+    from y2a.utils import MODEL_NAME, analyze_text, load_sentencizer, load_spacy
+
+    text = parse_into_word_store(subtitle_path).text
+    results = {}
+    for name, nlp in (("fast", load_sentencizer()), ("full", load_spacy(MODEL_NAME))):
+        t = time.perf_counter()
+        doc = analyze_text(nlp, text, {})
+        results[name] = (time.perf_counter() - t, get_sentence_ends(doc))
+
+    fast_sec, fast_ends = results["fast"]
+    full_sec, full_ends = results["full"]
+    matched = len(fast_ends & full_ends)
+    recall = matched / len(full_ends) if full_ends else 1.0
+    precision = matched / len(fast_ends) if fast_ends else 1.0
+
+    ok = recall >= min_recall
+    status = "[green]OK[/]" if ok else "[red]NG[/]"
+    print("[cyan][BENCH][/]", subtitle_path)
+    print("[cyan][BENCH][/]", f"\tfast: {fast_sec:,.2f} s, full: {full_sec:,.2f} s ({full_sec / max(fast_sec, 1e-9):,.0f}x)")
+    print("[cyan][BENCH][/]", f"\tprecision: {precision:.3f}, recall: {recall:.3f} (min {min_recall})", status)
+    return ok
+
+
+def generate_srv2(file_path: str, n_words: int, punctuated: bool = True, seed: int = 0):
+    """
+    n_words 語の合成 srv2 を書き出す（語の間隔と句読点は乱数で決める）
+    """
+    rng = random.Random(seed)
+    t = 0
+    sentence_len = 0
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8" ?><timedtext format="2">\n')
+        for _ in range(n_words):
+            word = rng.choice(VOCAB)
+            sentence_len += 1
+            if punctuated:
+                if sentence_len == 1:
+                    word = word.capitalize()
+                r = rng.random()
+                if sentence_len >= 4 and r < 0.08:
+                    word += rng.choice(".?!")
+                    sentence_len = 0
+                elif r < 0.15:
+                    word += ","
+            f.write(f'<text t="{t}" d="2000">{escape(word)}</text>\n')
+            # たまに長い間（1 秒以上）を空ける
+            t += rng.choice((120, 200, 280, 350)) if rng.random() > 0.02 else 1500
+        f.write("</timedtext>\n")
+
+
+def generate_mp4(file_path: str, seconds: int = SUITE_VIDEO_SECONDS):
+    """
+    lavfi のテストパターンとサイン波から小さな mp4 を作る
+    """
+    from y2a.extractor import get_ffmpeg_exe
+
+    cmd = [
+        get_ffmpeg_exe(), "-y",
+        "-f", "lavfi", "-i", f"testsrc=size=320x180:rate=10:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+        "-c:v", "mpeg4", "-c:a", "aac", "-shortest",
+        "-loglevel", "quiet",
+        file_path,
+    ]
+    subprocess.run(cmd, check=True)
+
+
+@contextmanager
+def working_directory(path: str):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def timeit(fn, repeat: int = 3):
+    """
+    fn() の最短時間（秒）と最後の戻り値を返す（進捗表示は捨てる）
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            t = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - t)
+    return best, result
+
+
+def bench_parse(work_dir: str, n_words: int, punctuated: bool, repeat: int) -> dict[str, float]:
+    """
+    合成字幕で parse_into_timedwords と各 splitter を計る
+    """
+    from y2a.entity import WordStore
+    from y2a.parser import merge_timedwords_into_segments, parse_into_timedwords
+    from y2a.splitter import (
+        split_at_doc_boundaries,
+        split_at_speech_boundaries,
+        split_at_timestamp_boundaries,
+    )
+    from y2a.utils import MODEL_NAME, analyze_text, load_sentencizer, load_spacy
+
+    label = f"{n_words // 1000}k{'' if punctuated else '-nopunct'}"
+    subtitle_path = os.path.join(work_dir, f"{label}.srv2")
+    generate_srv2(subtitle_path, n_words, punctuated)
+
+    times = {}
+    times[f"parse_into_timedwords@{label}"], timedwords = timeit(
+        lambda: parse_into_timedwords(subtitle_path), repeat)
+    store = WordStore.from_timedwords(timedwords)
+
+    config = {
+        "boundaries": ("sentence", "speech"),
+        "min_words": 3,
+        "max_duration": timedelta(seconds=8),
+    }
+    with redirect_stdout(io.StringIO()):
+        doc = analyze_text(load_sentencizer(), store.text, config)
+    times[f"split_at_doc_boundaries@{label}"], spans = timeit(
+        lambda: split_at_doc_boundaries(doc, config), repeat)
+
+    # 文法的境界はモデルがインストール済みの場合のみ（ダウンロードはしない）
+    if find_spec(MODEL_NAME) is not None and n_words <= SUITE_SIZES[0]:
+        grammar_config = {**config, "boundaries": ("sentence", "grammar", "speech")}
+        with redirect_stdout(io.StringIO()):
+            full_doc = analyze_text(load_spacy(MODEL_NAME, ("ner", "lemmatizer")), store.text, grammar_config)
+        times[f"split_at_doc_boundaries+grammar@{label}"], _ = timeit(
+            lambda: split_at_doc_boundaries(full_doc, grammar_config), repeat)
+
+    segments = merge_timedwords_into_segments(store, spans)
+    times[f"split_at_timestamp_boundaries@{label}"], segments = timeit(
+        lambda: split_at_timestamp_boundaries(segments), repeat)
+    times[f"split_at_speech_boundaries@{label}"], _ = timeit(
+        lambda: split_at_speech_boundaries(segments, config), repeat)
+
+    return times
+
+
+def bench_media(work_dir: str, repeat: int) -> dict[str, float]:
+    """
+    合成動画で extract と write_in_apkg を計る（出力は毎回作り直す）
+    """
+    from y2a.extractor import extract
+    from y2a.generator import create_notes, write_in_apkg
+    from y2a.parser import apply_margins, parse_into_word_store
+    from y2a.splitter import split_at_speech_boundaries
+
+    video_id = "benchvideo0"
+    config = {
+        "video_id": video_id,
+        "video_path": f"{video_id}/{video_id}.mp4",
+        "formats": ("apkg",),
+        "boundaries": ("speech",),
+        "min_words": 3,
+        "max_duration": timedelta(seconds=4),
+        "margin_start": timedelta(milliseconds=100),
+        "margin_end": timedelta(milliseconds=25),
+        "image_ext": "webp",
+        "audio_ext": "webm",
+    }
+
+    with working_directory(work_dir):
+        os.makedirs(video_id, exist_ok=True)
+        generate_mp4(config["video_path"])
+
+        # 動画の長さに収まる字幕を作る
+        subtitle_path = f"{video_id}/{video_id}.srv2"
+        generate_srv2(subtitle_path, SUITE_VIDEO_SECONDS * 3, punctuated=False)
+        store = parse_into_word_store(subtitle_path)
+        with redirect_stdout(io.StringIO()):
+            segments = split_at_speech_boundaries([store.view()], config)
+            segments = apply_margins(segments, config)
+
+        def _extract():
+            shutil.rmtree(f"{video_id}/media", ignore_errors=True)
+            audio_path = config["video_path"].replace(".mp4", ".aac")
+            if os.path.exists(audio_path):
+                os.remove(audio_path)
+            return extract(segments, config)
+
+        times = {}
+        times["extract"], media = timeit(_extract, repeat)
+
+        notes = create_notes(segments, config)
+        times["write_in_apkg"], _ = timeit(lambda: write_in_apkg(notes, media, config), repeat)
+
+    return times
+
+
+def run_suite(sizes=SUITE_SIZES, repeat: int = 3, with_media: bool = True) -> dict[str, float]:
+    times = {}
+    with tempfile.TemporaryDirectory(prefix="y2a-bench-") as work_dir:
+        for n_words in sizes:
+            for punctuated in (True, False):
+                times.update(bench_parse(work_dir, n_words, punctuated, repeat))
+        if with_media:
+            times.update(bench_media(work_dir, repeat))
+    return times
+
+
+def get_baseline_path() -> str:
+    from y2a.cache import get_cache_dir
+
+    return os.path.join(get_cache_dir(), "bench.json")
+
+
+def load_baseline(file_path: str) -> dict[str, float]:
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(file_path: str, times: dict[str, float]):
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(times, f, indent=4, sort_keys=True)
+    print("[cyan][INFO][/]", f"[green]File created: {file_path}")
+
+
+def get_budget(stage: str) -> float | None:
+    """
+    STAGE_BUDGETS から、そのステージ（"name@10k-nopunct" なら 1 万語分）の上限を求める
+    """
+    name, _, label = stage.partition("@")
+    budget = STAGE_BUDGETS.get(name)
+    if budget is None or not label:
+        return budget
+    n_words = int(label.split("k")[0]) * 1000
+    return max(budget * n_words / 100_000, SLOWDOWN_MIN_SEC)
+
+
+def check_suite(times: dict[str, float], baseline: dict[str, float]) -> bool:
+    """
+    STAGE_BUDGETS の上限を超えたステージ、ベースラインより SLOWDOWN_TOLERANCE 倍以上
+    遅いステージ、上限が定められていないステージがあれば NG
+    """
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Stage")
+    table.add_column("Time (ms)", justify="right")
+    table.add_column("Budget (ms)", justify="right")
+    table.add_column("Baseline (ms)", justify="right")
+    table.add_column("")
+
+    ok = True
+    for stage, sec in times.items():
+        budget = get_budget(stage)
+        base = baseline.get(stage)
+        if budget is None:
+            status = "[red]NO BUDGET[/]"
+        elif sec > budget:
+            status = "[red]NG[/]"
+        elif base is not None and sec > base * SLOWDOWN_TOLERANCE and sec - base > SLOWDOWN_MIN_SEC:
+            status = "[red]NG[/]"
+        else:
+            status = "[green]OK[/]"
+        ok = ok and status == "[green]OK[/]"
+        table.add_row(
+            stage,
+            f"{sec * 1000:,.1f}",
+            "" if budget is None else f"{budget * 1000:,.1f}",
+            "" if base is None else f"{base * 1000:,.1f}",
+            status,
+        )
+
+    Console().print(table)
+    return ok
@@ -0,0 +1,193 @@
+import os, json, hashlib, tempfile
+from importlib.metadata import version
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import spacy
+    from spacy.tokens.doc import Doc
+
+# 解析済み Doc の保存先（全動画・全実行で共有）
+CACHE_DIR_ENV = "Y2A_CACHE_DIR"
+DOC_CACHE_MAX_BYTES = 1 << 30
+
+# キャッシュの合計サイズ（保存先毎に、プロセス内で最初に保存するときに一度だけ数え、以降は足していく）
+_TOTAL_BYTES: dict[str, int] = {}
+
+
+def get_cache_dir() -> str:
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir:
+        return cache_dir
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "y2a")
+
+
+def get_doc_dir() -> str:
+    return os.path.join(get_cache_dir(), "docs")
+
+
+def get_doc_key(text: str, nlp: "spacy.Language") -> str:
+    """
+    テキスト、モデル名・バージョン、有効なコンポーネントから Doc のキーを作る
+    """
+    meta = nlp.meta
+    h = hashlib.sha256()
+    for part in (
+        f"{meta.get('lang')}_{meta.get('name')}",
+        meta.get("version", ""),
+        version("spacy"),
+        ",".join(nlp.pipe_names),
+        text,
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def get_doc_path(key: str) -> str:
+    return os.path.join(get_doc_dir(), key[:2], f"{key}.spacy")
+
+
+def get_chunks_path(text: str, nlp: "spacy.Language", params: str) -> str:
+    """
+    テキストの分割位置の保存先（Doc と同じキーに、分割の設定を加える）
+    """
+    key = hashlib.sha256(f"{get_doc_key(text, nlp)}\0{params}".encode("utf-8")).hexdigest()
+    return os.path.join(get_cache_dir(), "chunks", key[:2], f"{key}.json")
+
+
+def load_doc(text: str, nlp: "spacy.Language") -> "Doc | None":
+    from spacy.tokens import DocBin
+
+    file_path = get_doc_path(get_doc_key(text, nlp))
+    if not os.path.exists(file_path):
+        return None
+
+    try:
+        loaded_bin = DocBin().from_disk(file_path)
+        doc = next(loaded_bin.get_docs(nlp.vocab))
+    except Exception:
+        # 壊れたエントリは捨てて解析し直す
+        remove_file(file_path)
+        return None
+
+    # mtime を最終利用時刻として LRU に使う
+    os.utime(file_path)
+    return doc
+
+
+def save_doc(text: str, nlp: "spacy.Language", doc: "Doc", max_bytes: int = DOC_CACHE_MAX_BYTES):
+    from spacy.tokens import DocBin
+
+    file_path = get_doc_path(get_doc_key(text, nlp))
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    docbin = DocBin()
+    docbin.add(doc)
+    data = docbin.to_bytes()
+
+    # チャンク毎に保存するため、ディレクトリ全体を見直すのは上限を超えたときだけにする
+    doc_dir = get_doc_dir()
+    if doc_dir not in _TOTAL_BYTES:
+        _TOTAL_BYTES[doc_dir] = sum(size for _, size, _ in list_docs())
+    if os.path.exists(file_path):
+        _TOTAL_BYTES[doc_dir] -= os.path.getsize(file_path)
+    write_file(file_path, data)
+    _TOTAL_BYTES[doc_dir] += len(data)
+
+    if _TOTAL_BYTES[doc_dir] > max_bytes:
+        prune(max_bytes)
+
+
+def load_chunks(text: str, nlp: "spacy.Language", params: str) -> list[tuple[int, int, bool]] | None:
+    """
+    保存済みの分割位置（(start, end, 文末で終わるか) のリスト）
+    """
+    file_path = get_chunks_path(text, nlp, params)
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            spans = [(int(start), int(end), bool(is_end)) for start, end, is_end in json.load(f)]
+    except (OSError, ValueError, TypeError):
+        remove_file(file_path)
+        return None
+    if not spans or spans[-1][1] != len(text):
+        return None
+    return spans
+
+
+def save_chunks(text: str, nlp: "spacy.Language", params: str, spans: list[tuple[int, int, bool]]):
+    # 数値だけの小さなファイルなので、prune の対象（.spacy）には含めない
+    file_path = get_chunks_path(text, nlp, params)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    write_file(file_path, json.dumps(spans).encode("utf-8"))
+
+
+def write_file(file_path: str, data: bytes):
+    # 途中で落ちても壊れたファイルが残らないよう、一時ファイル経由で置き換える
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        remove_file(tmp_path)
+        raise
+
+
+def remove_file(file_path: str):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def list_docs() -> list[tuple[str, int, float]]:
+    """(path, size, mtime) のリスト"""
+    entries = []
+    doc_dir = get_doc_dir()
+    if not os.path.isdir(doc_dir):
+        return entries
+
+    for root, _, files in os.walk(doc_dir):
+        for name in files:
+            if not name.endswith(".spacy"):
+                continue
+            file_path = os.path.join(root, name)
+            try:
+                st = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            entries.append((file_path, st.st_size, st.st_mtime))
+    return entries
+
+
+def get_stats() -> dict:
+    entries = list_docs()
+    return {
+        "path": get_doc_dir(),
+        "docs": len(entries),
+        "bytes": sum(size for _, size, _ in entries),
+    }
+
+
+def prune(max_bytes: int = DOC_CACHE_MAX_BYTES) -> tuple[int, int]:
+    """
+    合計サイズが max_bytes を超えた分を、使われていない順に削除する
+    """
+    entries = sorted(list_docs(), key=lambda e: e[2])
+    total = sum(size for _, size, _ in entries)
+
+    removed = 0
+    freed = 0
+    for file_path, size, _ in entries:
+        if total <= max_bytes:
+            break
+        remove_file(file_path)
+        total -= size
+        removed += 1
+        freed += size
+
+    _TOTAL_BYTES[get_doc_dir()] = total
+    return removed, freed
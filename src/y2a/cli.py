@@ -1,22 +1,23 @@
 import os, sys
 from datetime import timedelta
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING
 from rich import print
 import rich_click as click
 
-from y2a.downloader import download
-from y2a.parser import parse
-from y2a.extractor import extract
-from y2a.generator import generate
-from y2a.utils import (
-    get_version,
-    write_in_vtt,
-    write_in_txt,
-    write_in_csv,
-    write_in_json
-)
+from y2a import cache as doc_cache
+from y2a import profiler
+from y2a.utils import get_version
+
+if TYPE_CHECKING:
+    from y2a.manifest import Manifest
+
+# 各ステージのモジュール（yt_dlp, spaCy, lxml, genanki 等）は、
+# `y2a -h` や短いジョブの起動を軽くするため、使うときに import する
 
 FORMATS = ("apkg", "csv", "json", "vtt", "txt", "spacy")
 BOUNDARIES = ("sentence", "grammar", "speech", "all")
+SEGMENTERS = ("greedy", "dp")
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
 def parse_video_string(video_string):
@@ -24,71 +25,53 @@ def parse_video_string(video_string):
     video_path = ""
     if video_string.endswith(".mp4"):
         video_path = video_string
-        video_id = os.path.splitext(os.path.basename(video_path))
+        video_id = os.path.splitext(os.path.basename(video_path))[0]
     elif len(video_string) == 11:
         video_id = video_string
         video_path = f"{video_id}/{video_id}.mp4"
     else:
         print("[red][ERROR][/]", "ID must be an 11-digit string.")
         sys.exit(1)
-        
+
     return video_id, video_path
 
 
-@click.command(context_settings=CONTEXT_SETTINGS,
-    help="Convert YouTube video into Anki deck")
-@click.version_option(
-    get_version(),
-    "-v", "--version",
-    prog_name="y2a"
-)
-@click.argument("video",
-    help="video ID or video filepath (.mp4)",
-    metavar="ID|PATH")
-@click.option("--subtitle", "-s",
-    help="subtitle filepath (.srv2)",
-    type=click.Path())
-@click.option("--format", "-f", default=["apkg"],
-    help="output format (multi: -f ... -f ...)",
-    multiple=True, show_default=True,
-    type=click.Choice(FORMATS, case_sensitive=False))
-@click.option("--max_duration", "-d", default=8000,
-    help="max duration (in ms) for each segment",
-    type=int, show_default=True)
-@click.option("--min_words", "-w", default=3,
-    help="min number of words for each segment",
-    type=int, show_default=True)
-@click.option("--margin", "-m", default=(100, 25),
-    help="audio margins (in ms) for each segment",
-    type=(int, int), metavar="START END", show_default=True)
-@click.option("--boundary", "-b", default=["all"],
-    help="boundary types used to split the text (multi: -b ... -b ...)",
-    multiple=True, show_default=True,
-    type=click.Choice(BOUNDARIES, case_sensitive=False))
-@click.option("--keep_dups", is_flag=True,
-    help="prevent removing duplicated lines")
-@click.option("--dry", is_flag=True,
-    help="run without video DL and file creation")
-@click.option("--verbose", "-V", is_flag=True,
-    help="run verbosely")
-@click.option("--debug", "-D", is_flag=True,
-    help="run in debug mode")
-def main(video, **args):
+def read_video_list(sources) -> list[str]:
+    """
+    IDやパスに加え、1行1件のリストファイル（# はコメント）を展開する
+    """
+    videos = []
+    for source in sources:
+        if source.endswith(".mp4") or not os.path.isfile(source):
+            videos.append(source)
+            continue
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.split("#")[0].strip()
+                if line:
+                    videos.append(line)
+    return videos
+
+
+def build_config(video, args):
     video_id, video_path = parse_video_string(video)
     subtitle_path = video_path.replace(".mp4", ".en-orig.srv2")
     subtitle_path = args.get("subtitle") or subtitle_path
-    
+
     boundaries = args.get("boundary")
     if "all" in boundaries:
         boundaries = ("sentence", "grammar", "speech")
 
-    config = {
+    return {
         "video_id": video_id,
         "video_path": video_path,
         "subtitle_path": subtitle_path,
         "formats": args.get("format"),
         "boundaries": boundaries,
+        "grammar_rules": args.get("rules"),
+        "segmenter": args.get("segmenter"),
         "should_keep_dups": args.get("keep_dups"),
+        "is_delta": args.get("delta"),
         "max_duration": timedelta(milliseconds=args.get("max_duration")),
         "min_words": args.get("min_words"),
         "margin_start": timedelta(milliseconds=args.get("margin")[0]),
@@ -96,44 +79,753 @@ def main(video, **args):
         "is_dry": args.get("dry"),
         "is_verbose": args.get("verbose"),
         "is_debug": args.get("debug"),
+        "image_jobs": args.get("image_jobs"),
+        "audio_jobs": args.get("audio_jobs"),
+        "nlp_jobs": args.get("nlp_jobs"),
         "image_ext": "webp",
         "audio_ext": "webm",
     }
 
+
+def download_stage(config):
+    from y2a.downloader import download
+
+    video_id = config.get("video_id")
+    if not os.path.exists(video_id):
+        os.makedirs(video_id, exist_ok=True)
+    with profiler.stage("download", config):
+        download(video_id, config)
+
+
+def download_subtitle_stage(config):
+    from y2a.downloader import download_subtitle
+
+    video_id = config.get("video_id")
+    if not os.path.exists(video_id):
+        os.makedirs(video_id, exist_ok=True)
+    with profiler.stage("download_subtitle", config):
+        download_subtitle(video_id, config)
+
+
+def download_video_stage(config):
+    from y2a.downloader import download_video
+
+    with profiler.stage("download_video", config):
+        download_video(config.get("video_id"), config)
+
+
+def prepare_audio(config, video_future: Future):
+    """
+    動画のダウンロードを待って、音声全体を抽出する（バックグラウンド用）
+    """
+    from y2a.extractor import extract_audio
+
+    video_future.result()
+    if not writes_apkg(config):
+        return None
+    with profiler.stage("extract_audio", config):
+        return extract_audio(config.get("video_path"), config.get("is_debug"), show_progress=False)
+
+
+def write_segments(segments, config):
+    from y2a.utils import write_in_vtt, write_in_txt
+
+    video_id = config.get("video_id")
+
+    if "vtt" in config.get("formats") and not config.get("is_dry"):
+        with profiler.span("write_in_vtt"):
+            write_in_vtt(f"{video_id}/{video_id}.out.vtt", segments)
+
+    if "txt" in config.get("formats") and not config.get("is_dry"):
+        with profiler.span("write_in_txt"):
+            write_in_txt(f"{video_id}/{video_id}.txt", segments)
+
+
+def write_notes(segments, config):
+    from y2a.generator import iter_notes
+    from y2a.utils import write_in_csv, write_in_json
+
+    video_id = config.get("video_id")
+
+    # ノートは書き出し先毎に一件ずつ作る（全件をリストにしない）
+    if "csv" in config.get("formats") and not config.get("is_dry"):
+        rows = (n.values() for n in iter_notes(segments, config))
+        with profiler.span("write_in_csv"):
+            write_in_csv(f"{video_id}/{video_id}.csv", rows)
+
+    if "json" in config.get("formats") and not config.get("is_dry"):
+        with profiler.span("write_in_json"):
+            write_in_json(f"{video_id}/{video_id}.json", iter_notes(segments, config))
+
+
+def writes_apkg(config) -> bool:
+    return not config.get("is_dry") and "apkg" in config.get("formats")
+
+
+def save_manifest(manifest: "Manifest", config):
+    if not config.get("is_dry"):
+        manifest.save()
+
+
+def get_parse_fingerprint(config) -> str:
+    from y2a.manifest import PARSE_KEYS, config_slice, file_digest, fingerprint
+    from y2a.grammar import get_rules_path
+    from y2a.utils import get_pipeline_name
+
+    # 読み込むパイプラインの構成で区別する（spaCy は manifest にない場合だけ読み込む）
+    return fingerprint(
+        "parse",
+        file_digest(config.get("subtitle_path")),
+        file_digest(get_rules_path(config)),
+        get_pipeline_name(config),
+        config_slice(config, PARSE_KEYS),
+    )
+
+
+def load_parsed_segments(store, manifest: "Manifest", parse_fp: str, config):
+    from y2a.manifest import load_segments
+
+    # spacy の書き出しが必要な場合は Doc を取り直す
+    if "spacy" in config.get("formats"):
+        return None
+    record = manifest.get("parse", parse_fp)
+    if record is None:
+        return None
+    print("[cyan][INFO][/]", "Skipped. Segments are up to date.")
+    return load_segments(store, record["segments"])
+
+
+def parse_stage(config, manifest: "Manifest", is_overlapped: bool = False):
+    with profiler.stage("parse", config):
+        return _parse_stage(config, manifest, is_overlapped)
+
+
+def _parse_stage(config, manifest: "Manifest", is_overlapped: bool = False):
+    """
+    (segments, parse_fp, stream) を返す
+
+    is_overlapped で解析が必要な場合は、解析せずに stream（解析しながらセグメントを
+    一つずつ流すイテレータ）を返す。回し切ると segments が埋まり、manifest に記録される。
+    """
+    from y2a.manifest import dump_segments
+    from y2a.parser import can_stream, iter_parsed_segments, parse_document, parse_into_word_store
+    from y2a.utils import get_spacy_document
+
+    parse_fp = get_parse_fingerprint(config)
+    store = parse_into_word_store(config.get("subtitle_path"))
+
+    segments = load_parsed_segments(store, manifest, parse_fp, config)
+    if segments is not None:
+        return segments, parse_fp, None
+
+    if is_overlapped and can_stream(config):
+        segments = []
+
+        def _stream():
+            # extract が受け取った分から切り出すため、解析の時間はここで測る
+            for seg in profiler.timed("parse", iter_parsed_segments(store, config), "stage", is_exclusive=False):
+                segments.append(seg)
+                yield seg
+            print("[cyan][INFO][/]", f"\t-> {len(segments):,} segments.")
+            manifest.set("parse", parse_fp, segments=dump_segments(segments))
+
+        return segments, parse_fp, _stream()
+
+    if can_stream(config):
+        # Doc はチャンク毎に解析して手放す（逐次なのは解析側のメモリだけ）
+        segments = list(iter_parsed_segments(store, config))
+        print("[cyan][INFO][/]", f"\t-> {len(segments):,} segments.")
+    else:
+        segments = parse_document(store, get_spacy_document(store.text, config), config)
+    manifest.set("parse", parse_fp, segments=dump_segments(segments))
+
+    return segments, parse_fp, None
+
+
+def get_extract_fingerprint(config, parse_fp: str) -> str:
+    from y2a.manifest import EXTRACT_KEYS, config_slice, file_stamp, fingerprint
+
+    return fingerprint(
+        "extract",
+        parse_fp,
+        file_stamp(config.get("video_path")),
+        config_slice(config, EXTRACT_KEYS),
+    )
+
+
+def record_extract(manifest: "Manifest", extract_fp: str, media: list[str], segments, config):
+    from y2a.extractor import get_media_files
+
+    # 失敗したクリップがあれば記録せず（前回の記録も消し）、次回にやり直す
+    if len(media) == len(get_media_files(segments, config)):
+        manifest.set("extract", extract_fp)
+    else:
+        manifest.discard("extract")
+
+
+def extract_stage(segments, config, manifest: "Manifest", parse_fp: str, audio_future: Future | None = None):
+    with profiler.stage("extract", config):
+        return _extract_stage(segments, config, manifest, parse_fp, audio_future)
+
+
+def _extract_stage(segments, config, manifest: "Manifest", parse_fp: str, audio_future: Future | None = None):
+    from y2a.extractor import extract, get_media_files
+
+    if not writes_apkg(config):
+        return extract(segments, config), None
+
+    extract_fp = get_extract_fingerprint(config, parse_fp)
+    media = get_media_files(segments, config)
+    if manifest.get("extract", extract_fp) and all(os.path.exists(p) for p in media):
+        print("[cyan][INFO][/]", "Skipped. Media files are up to date.")
+        return media, extract_fp
+
+    media = extract(segments, config, audio_future)
+    record_extract(manifest, extract_fp, media, segments, config)
+    return media, extract_fp
+
+
+def overlapped_stage(stream, segments: list, config, manifest: "Manifest", parse_fp: str,
+                     audio_future: Future, video_future: Future):
+    """
+    解析しながら、出来たセグメントから順にメディアを切り出す（parse と extract を重ねる）
+
+    画像は動画のダウンロード、音声は音声全体の抽出を待ってから切り出し始める。
+    """
+    from y2a.extractor import extract
+
+    with profiler.stage("extract", config):
+        media = extract(stream, config, audio_future, video_future)
+        # 動画が揃ってから指紋を取る
+        video_future.result()
+        extract_fp = get_extract_fingerprint(config, parse_fp)
+        record_extract(manifest, extract_fp, media, segments, config)
+    return media, extract_fp
+
+
+def generate_stage(segments, media, config, manifest: "Manifest", extract_fp: str | None):
+    with profiler.stage("generate", config):
+        return _generate_stage(segments, media, config, manifest, extract_fp)
+
+
+def _generate_stage(segments, media, config, manifest: "Manifest", extract_fp: str | None):
+    from y2a.generator import generate
+    from y2a.manifest import fingerprint
+
+    if extract_fp is None:
+        generate(segments, media, config)
+        return
+
+    video_id = config.get("video_id")
+    generate_fp = fingerprint("generate", extract_fp)
+    # メディアが全て揃った（extract が記録された）場合だけ、パッケージを最新とみなす
+    is_extracted = manifest.get("extract", extract_fp) is not None
+    # --delta では、前回から何も変わっていなければ書き出すノートがない
+    is_written = config.get("is_delta") or os.path.exists(f"{video_id}/{video_id}.apkg")
+    if is_extracted and manifest.get("generate", generate_fp) and is_written:
+        print("[cyan][INFO][/]", "Skipped. Anki package is up to date.")
+        return
+
+    generate(segments, media, config)
+    if is_extracted:
+        manifest.set("generate", generate_fp)
+    else:
+        manifest.discard("generate")
+
+
+def media_stage(segments, config, manifest: "Manifest", parse_fp: str):
+    media, extract_fp = extract_stage(segments, config, manifest, parse_fp)
+    generate_stage(segments, media, config, manifest, extract_fp)
+    write_notes(segments, config)
+    save_manifest(manifest, config)
+
+
+def start_profile(args):
+    if args.get("profile") or args.get("profile_hook"):
+        profiler.enable(args.get("profile_hook"))
+
+
+def finish_profile(file_path: str = "trace.json"):
+    if profiler.is_enabled():
+        profiler.write_trace(file_path)
+        profiler.print_summary()
+
+
+def common_options(f):
+    options = [
+        click.option("--subtitle", "-s",
+            help="subtitle filepath (.srv2)",
+            type=click.Path()),
+        click.option("--format", "-f", default=["apkg"],
+            help="output format (multi: -f ... -f ...)",
+            multiple=True, show_default=True,
+            type=click.Choice(FORMATS, case_sensitive=False)),
+        click.option("--max_duration", "-d", default=8000,
+            help="max duration (in ms) for each segment",
+            type=int, show_default=True),
+        click.option("--min_words", "-w", default=3,
+            help="min number of words for each segment",
+            type=int, show_default=True),
+        click.option("--margin", "-m", default=(100, 25),
+            help="audio margins (in ms) for each segment",
+            type=(int, int), metavar="START END", show_default=True),
+        click.option("--boundary", "-b", default=["all"],
+            help="boundary types used to split the text (multi: -b ... -b ...)",
+            multiple=True, show_default=True,
+            type=click.Choice(BOUNDARIES, case_sensitive=False)),
+        click.option("--segmenter", default="greedy",
+            help="greedy: split pass by pass, dp: choose all cuts at once (balanced lengths)",
+            type=click.Choice(SEGMENTERS, case_sensitive=False), show_default=True),
+        click.option("--rules", default=None,
+            help="JSON file of grammatical boundary rules (default: built-in rules)",
+            type=click.Path(exists=True, dir_okay=False)),
+        click.option("--image_jobs", default=0,
+            help="concurrent ffmpeg processes for images (0: auto)",
+            type=click.IntRange(min=0), show_default=True),
+        click.option("--audio_jobs", default=0,
+            help="concurrent ffmpeg processes for audio (0: auto)",
+            type=click.IntRange(min=0), show_default=True),
+        click.option("--nlp_jobs", default=0,
+            help="processes for parsing long transcripts in chunks (0: auto)",
+            type=click.IntRange(min=0), show_default=True),
+        click.option("--keep_dups", is_flag=True,
+            help="prevent removing duplicated lines"),
+        click.option("--delta", is_flag=True,
+            help="write only new or changed notes into an update package"),
+        click.option("--dry", is_flag=True,
+            help="run without video DL and file creation"),
+        click.option("--verbose", "-V", is_flag=True,
+            help="run verbosely"),
+        click.option("--debug", "-D", is_flag=True,
+            help="run in debug mode"),
+        click.option("--profile", is_flag=True,
+            help="record time and memory per stage into trace.json (Chrome trace format)"),
+        click.option("--profile_hook", default=None,
+            help="also profile each stage with cProfile (.prof) or pyinstrument (.html), implies --profile",
+            type=click.Choice(profiler.HOOKS, case_sensitive=False)),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+class DefaultGroup(click.RichGroup):
+    """
+    サブコマンド名以外で始まる引数は `run` に渡す（`y2a ID` を維持するため）
+    """
+
+    def parse_args(self, ctx, args):
+        passthrough = set(CONTEXT_SETTINGS["help_option_names"]) | {"-v", "--version"}
+        if args and args[0] not in self.commands and args[0] not in passthrough:
+            args = ["run"] + args
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultGroup, context_settings=CONTEXT_SETTINGS,
+    help="Convert YouTube video into Anki deck (`y2a ID` is short for `y2a run ID`)")
+@click.version_option(
+    get_version(),
+    "-v", "--version",
+    prog_name="y2a"
+)
+def main():
+    pass
+
+
+@main.command(context_settings=CONTEXT_SETTINGS,
+    help="Convert YouTube video into Anki deck")
+@click.argument("video",
+    help="video ID or video filepath (.mp4)",
+    metavar="ID|PATH")
+@common_options
+def run(video, **args):
+    start_profile(args)
+    try:
+        run_video(video, args)
+    finally:
+        finish_profile()
+
+
+def run_video(video, args):
+    from y2a.manifest import Manifest
+
+    config = build_config(video, args)
+
     if config.get("is_debug"):
         print(config)
 
     print()
     print("[green][TASK] [0/3][/]", "Downloading the video and subtitle...")
-    if not os.path.exists(video_id):
-        os.makedirs(video_id, exist_ok=True)
-    download(video_id, config)
+    download_subtitle_stage(config)
+
+    manifest = Manifest.load(config.get("video_id"))
+
+    # 字幕が揃った時点で解析を始め、動画のダウンロードと音声の抽出は裏で並行させる
+    with ThreadPoolExecutor(max_workers=2) as background:
+        video_future = background.submit(download_video_stage, config)
+        audio_future = background.submit(prepare_audio, config, video_future)
+
+        print()
+        print("[green][TASK] [1/3][/]", "Parsing the subtitle into segments...")
+        # メディアを書き出す場合は、解析しながら切り出す
+        segments, parse_fp, stream = parse_stage(config, manifest, is_overlapped=writes_apkg(config))
+
+        if stream is not None:
+            print()
+            print("[green][TASK] [2/3][/]", "Extracting media files while parsing...")
+            media, extract_fp = overlapped_stage(
+                stream, segments, config, manifest, parse_fp, audio_future, video_future)
+            write_segments(segments, config)
+            save_manifest(manifest, config)
+        else:
+            write_segments(segments, config)
+            save_manifest(manifest, config)
+
+            print()
+            print("[green][TASK] [2/3][/]", "Extracting media files...")
+            if not video_future.done():
+                print("[cyan][INFO][/]", "Waiting for the video download...")
+            video_future.result()
+            media, extract_fp = extract_stage(segments, config, manifest, parse_fp, audio_future)
+
+        print()
+        print("[green][TASK] [3/3][/]", "Generating an Anki package...")
+        generate_stage(segments, media, config, manifest, extract_fp)
+        write_notes(segments, config)
+        save_manifest(manifest, config)
+
+
+@main.command(context_settings=CONTEXT_SETTINGS,
+    help="Convert many YouTube videos with one shared spaCy pipeline")
+@click.argument("sources", nargs=-1, required=True,
+    help="video IDs, video filepaths (.mp4) or list files (one per line)",
+    metavar="ID|PATH|FILE...")
+@click.option("--jobs", "-j", default=2,
+    help="number of videos downloaded / extracted concurrently",
+    type=click.IntRange(min=1), show_default=True)
+@common_options
+def batch(sources, jobs, **args):
+    start_profile(args)
+    try:
+        run_batch(sources, jobs, args)
+    finally:
+        finish_profile()
+
+
+def run_batch(sources, jobs, args):
+    from y2a.manifest import Manifest, dump_segments
+    from y2a.parser import parse_document, parse_into_word_store
+    from y2a.utils import get_spacy_documents
+
+    if args.get("subtitle"):
+        print("[red][ERROR][/]", "--subtitle cannot be used in batch mode.")
+        sys.exit(1)
+
+    configs = [build_config(video, args) for video in read_video_list(sources)]
+    failed = []
 
     print()
-    print("[green][TASK] [1/3][/]", "Parsing the subtitle into segments...")
-    segments = parse(subtitle_path, config)
+    print("[green][TASK][/]", f"Processing {len(configs):,} videos...")
 
-    if "vtt" in config.get("formats") and not config.get("is_dry"):
-        write_in_vtt(f"{video_id}/{video_id}.out.vtt", segments)
+    # download -> parse -> extract/generate を動画間でパイプライン化する
+    # download と media は別スレッドで先行・後続させ、解析はメインスレッドの nlp.pipe で行う
+    with (
+        ThreadPoolExecutor(max_workers=jobs) as downloader,
+        ThreadPoolExecutor(max_workers=jobs) as media_worker
+    ):
+        downloads = [(c, downloader.submit(download_stage, c)) for c in configs]
 
-    if "txt" in config.get("formats") and not config.get("is_dry"):
-        write_in_txt(f"{video_id}/{video_id}.txt", segments)
+        media_jobs = []
+
+        def _submit(segments, config, manifest, parse_fp):
+            write_segments(segments, config)
+            save_manifest(manifest, config)
+            future = media_worker.submit(media_stage, segments, config, manifest, parse_fp)
+            media_jobs.append((config, future))
+
+        def _transcripts():
+            for config, future in downloads:
+                try:
+                    future.result()
+                    manifest = Manifest.load(config.get("video_id"))
+                    parse_fp = get_parse_fingerprint(config)
+                    store = parse_into_word_store(config.get("subtitle_path"))
+                except (Exception, SystemExit) as e:
+                    print("[red][ERROR][/]", config.get("video_id"), e)
+                    failed.append(config.get("video_id"))
+                    continue
+
+                # 分割結果が最新なら spaCy に通さない
+                segments = load_parsed_segments(store, manifest, parse_fp, config)
+                if segments is not None:
+                    _submit(segments, config, manifest, parse_fp)
+                    continue
+
+                yield store.text, config, (config, store, manifest, parse_fp)
+
+        for doc, (config, store, manifest, parse_fp) in get_spacy_documents(_transcripts()):
+            print("[cyan][INFO][/]", f"Segmenting {config.get('video_id')}...")
+            with profiler.stage("parse", config):
+                segments = parse_document(store, doc, config)
+            manifest.set("parse", parse_fp, segments=dump_segments(segments))
+            _submit(segments, config, manifest, parse_fp)
+
+        for config, future in media_jobs:
+            try:
+                future.result()
+            except (Exception, SystemExit) as e:
+                print("[red][ERROR][/]", config.get("video_id"), e)
+                failed.append(config.get("video_id"))
 
     print()
-    print("[green][TASK] [2/3][/]", "Extracting media files...")
-    media = extract(segments, config)
+    print("[cyan][INFO][/]", f"{len(configs) - len(failed):,}/{len(configs):,} videos done.")
+    if failed:
+        print("[red][ERROR][/]", "Failed:", ", ".join(failed))
+        sys.exit(1)
+
+
+def get_merged_path(deck_name: str) -> str:
+    """
+    "channel::sub" のようなデッキ名から、既定の書き出し先（channel-sub.apkg）を作る
+    """
+    name = deck_name.replace("::", "-").replace("/", "-").replace(os.sep, "-").strip()
+    return f"{name}.apkg"
+
+
+@main.command(context_settings=CONTEXT_SETTINGS,
+    help="Merge processed videos into Anki packages with a deck per video")
+@click.argument("sources", nargs=-1, required=True,
+    help="video IDs, video filepaths (.mp4) or list files (one per line)",
+    metavar="ID|PATH|FILE...")
+@click.option("--deck", "-n", required=True,
+    help="parent deck name (e.g. a channel), each video goes to NAME::VIDEO_ID")
+@click.option("--output", "-o", default=None,
+    help="output file path (.apkg) [default: NAME.apkg]",
+    type=click.Path(dir_okay=False))
+@click.option("--max_size", default=500,
+    help="max size of each package (in MB), split into NAME-01.apkg, ... beyond this",
+    type=click.IntRange(min=1), show_default=True)
+@click.option("--jobs", "-j", default=0,
+    help="processes building the notes of each video (0: auto)",
+    type=click.IntRange(min=0), show_default=True)
+def merge(sources, deck, output, max_size, jobs):
+    from y2a.generator import load_video_notes, write_merged_packages
+
+    configs = [
+        build_config(video, {
+            "format": ("apkg",),
+            "boundary": (),
+            "max_duration": 0,
+            "margin": (0, 0),
+        })
+        for video in read_video_list(sources)
+    ]
+    # 空のリストファイル（コメントだけの場合も）
+    if not configs:
+        print("[red][ERROR][/]", "No videos to merge.")
+        sys.exit(1)
+
+    jobs = jobs or max(1, os.cpu_count() // 2)
+    file_path = output or get_merged_path(deck)
 
     print()
-    print("[green][TASK] [3/3][/]", "Generating an Anki package...")
-    notes = generate(segments, media, config)
+    print("[green][TASK] [1/2][/]", f"Loading the notes of {len(configs):,} videos...")
 
-    if "csv" in config.get("formats") and not config.get("is_dry"):
-        rows = [n.values() for n in notes]
-        write_in_csv(f"{video_id}/{video_id}.csv", rows)
+    videos = []
+    failed = []
+    # 字幕の読み込みとノートの生成は動画毎に独立しているので、プロセスに分ける
+    with ProcessPoolExecutor(max_workers=min(jobs, len(configs))) as pool:
+        futures = [(c, pool.submit(load_video_notes, c)) for c in configs]
+        for config, future in futures:
+            video_id = config.get("video_id")
+            try:
+                notes, skipped = future.result()
+            except Exception as e:
+                print("[red][ERROR][/]", video_id, e)
+                failed.append(video_id)
+                continue
+            if skipped:
+                print("[yellow][WARN][/]", f"{video_id}: {skipped:,} notes without media files are left out.")
+            videos.append((video_id, notes))
 
-    if "json" in config.get("formats") and not config.get("is_dry"):
-        write_in_json(f"{video_id}/{video_id}.json", notes)
+    if not any(notes for _, notes in videos):
+        print("[red][ERROR][/]", "No notes to merge.")
+        sys.exit(1)
+
+    print()
+    print("[green][TASK] [2/2][/]", "Generating Anki packages...")
+    write_merged_packages(videos, deck, file_path, max_size << 20)
+
+    if failed:
+        print("[red][ERROR][/]", "Failed:", ", ".join(failed))
+        sys.exit(1)
+
+
+def parse_boundary_sets(values) -> list[tuple[str, ...]]:
+    """
+    "sentence,grammar" のようなカンマ区切りの指定を、境界の組み合わせのリストにする
+    """
+    results = []
+    for value in values:
+        names = tuple(v.strip().lower() for v in value.split(",") if v.strip())
+        unknown = [n for n in names if n not in BOUNDARIES]
+        if not names or unknown:
+            raise click.BadParameter(f"{value!r} (choose from {', '.join(BOUNDARIES)})", param_hint="--boundary")
+        if "all" in names:
+            names = ("sentence", "grammar", "speech")
+        results.append(names)
+    return results
+
+
+@main.command(context_settings=CONTEXT_SETTINGS,
+    help="Parse once per pipeline and compare segmentation settings (multi: -d ... -d ...)")
+@click.argument("video",
+    help="video ID or video filepath (.mp4)",
+    metavar="ID|PATH")
+@click.option("--subtitle", "-s",
+    help="subtitle filepath (.srv2)",
+    type=click.Path())
+@click.option("--max_duration", "-d", default=[8000],
+    help="max durations (in ms) to try",
+    multiple=True, show_default=True, type=int)
+@click.option("--min_words", "-w", default=[3],
+    help="min numbers of words to try",
+    multiple=True, show_default=True, type=int)
+@click.option("--boundary", "-b", default=["all"],
+    help="boundary sets to try, comma-separated (e.g. -b sentence -b sentence,grammar)",
+    multiple=True, show_default=True)
+@click.option("--segmenter", default=["greedy"],
+    help="segmenters to try",
+    multiple=True, show_default=True,
+    type=click.Choice(SEGMENTERS, case_sensitive=False))
+@click.option("--rules", default=None,
+    help="JSON file of grammatical boundary rules (default: built-in rules)",
+    type=click.Path(exists=True, dir_okay=False))
+@click.option("--jobs", "-j", default=0,
+    help="processes evaluating the settings (0: auto)",
+    type=click.IntRange(min=0), show_default=True)
+@click.option("--nlp_jobs", default=0,
+    help="processes for parsing long transcripts in chunks (0: auto)",
+    type=click.IntRange(min=0), show_default=True)
+@click.option("--output", "-o", default=None,
+    help="write the results to a JSON file",
+    type=click.Path(dir_okay=False))
+@click.option("--debug", "-D", is_flag=True,
+    help="run in debug mode")
+def sweep(video, subtitle, max_duration, min_words, boundary, segmenter, rules, jobs, nlp_jobs, output, debug):
+    from y2a.parser import parse_into_word_store
+    from y2a.sweep import expand_grid, group_by_pipeline, run_groups, print_results, write_results
+    from y2a.utils import get_spacy_document
+
+    boundary_sets = parse_boundary_sets(boundary)
+    base = build_config(video, {
+        "subtitle": subtitle,
+        "format": (),
+        "boundary": boundary_sets[0],
+        "rules": rules,
+        "segmenter": segmenter[0],
+        "max_duration": max_duration[0],
+        "min_words": min_words[0],
+        "margin": (0, 0),
+        "dry": True,
+        "debug": debug,
+        "nlp_jobs": nlp_jobs,
+    })
+    configs = expand_grid(base, max_duration, min_words, boundary_sets, segmenter)
+
+    print()
+    print("[green][TASK] [1/2][/]", "Parsing the subtitle...")
+    download_subtitle_stage(base)
+    store = parse_into_word_store(base.get("subtitle_path"))
+    # 実際の実行と同じパイプラインで、パイプライン毎に一度だけ解析する
+    groups = group_by_pipeline(configs)
+    docs = [get_spacy_document(store.text, configs[group[0]]) for group in groups]
+
+    print()
+    print("[green][TASK] [2/2][/]", f"Evaluating {len(configs):,} settings...")
+    results = run_groups(store, docs, groups, configs, jobs)
+    print_results(results)
+
+    if output:
+        write_results(output, results)
+
+
+@main.command(context_settings=CONTEXT_SETTINGS,
+    help="Check the import time, fast sentence boundaries and per-stage timings")
+@click.argument("subtitles", nargs=-1,
+    help="compare the fast and full sentence boundaries on real subtitles",
+    metavar="[SUBTITLE.srv2]...",
+    type=click.Path(exists=True, dir_okay=False))
+@click.option("--suite", is_flag=True,
+    help="time each stage on synthetic srv2/mp4 fixtures")
+@click.option("--sizes", default=[10_000, 100_000],
+    help="word counts of the synthetic subtitles (multi: --sizes ... --sizes ...)",
+    multiple=True, show_default=True,
+    type=click.IntRange(min=1000))
+@click.option("--repeat", "-r", default=3,
+    help="runs per stage (the fastest one is kept)",
+    type=click.IntRange(min=1), show_default=True)
+@click.option("--no_media", is_flag=True,
+    help="skip extract and write_in_apkg")
+@click.option("--baseline", default=None,
+    help="baseline JSON (default: $Y2A_CACHE_DIR/bench.json)",
+    type=click.Path(dir_okay=False))
+@click.option("--save", is_flag=True,
+    help="store this run as the new baseline")
+def bench(subtitles, suite, sizes, repeat, no_media, baseline, save):
+    from y2a.bench import (
+        check_import_time,
+        check_sentence_boundaries,
+        check_suite,
+        get_baseline_path,
+        load_baseline,
+        run_suite,
+        save_baseline,
+        show_import_time,
+    )
+
+    ok = check_import_time()
+    if not ok:
+        show_import_time()
+
+    for subtitle_path in subtitles:
+        ok = check_sentence_boundaries(subtitle_path) and ok
+
+    if suite:
+        baseline_path = baseline or get_baseline_path()
+        if not os.path.exists(baseline_path) and not save:
+            print("[yellow][WARN][/]", f"No baseline at {baseline_path}. Checking the stage budgets only.")
+        times = run_suite(sizes, repeat, not no_media)
+        ok = check_suite(times, load_baseline(baseline_path)) and ok
+        if save:
+            save_baseline(baseline_path, times)
+
+    sys.exit(0 if ok else 1)
+
+
+@main.group(context_settings=CONTEXT_SETTINGS,
+    help="Manage the shared spaCy document cache")
+def cache():
+    pass
+
+
+@cache.command(context_settings=CONTEXT_SETTINGS,
+    help="Show the size of the document cache")
+def stats():
+    stats = doc_cache.get_stats()
+    print("[cyan][INFO][/]", f"Path: {stats['path']}")
+    print("[cyan][INFO][/]", f"{stats['docs']:,} documents, {stats['bytes'] / (1 << 20):,.1f} MB")
+
+
+@cache.command(context_settings=CONTEXT_SETTINGS,
+    help="Evict least recently used documents down to a size")
+@click.option("--max_size", "-s", default=doc_cache.DOC_CACHE_MAX_BYTES >> 20,
+    help="max cache size (in MB), 0 to clear",
+    type=click.IntRange(min=0), show_default=True)
+def prune(max_size):
+    removed, freed = doc_cache.prune(max_size << 20)
+    print("[cyan][INFO][/]", f"Removed {removed:,} documents ({freed / (1 << 20):,.1f} MB).")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,19 +1,10 @@
 import os, sys
 from rich import print
-from yt_dlp import YoutubeDL
 
 
-def download(video_id: str, config):
-    video_path = config.get("video_path")
-    subtitle_path = config.get("subtitle_path")
-    video_format_id = "18"
-
+def get_ydl_opts(config) -> dict:
     ydl_opts = {
         "progress": True,
-        "writesubtitles": True,
-        "writeautomaticsub": True, # --write-auto-subs
-        "subtitleslangs": ["en.orig"],
-        "subtitlesformat": "srv2",
         "outtmpl": "%(id)s/%(id)s.%(ext)s", # -o
     }
 
@@ -21,29 +12,12 @@ def download(video_id: str, config):
     if not config.get("is_debug"):
         ydl_opts["quiet"] = True
 
-    video_exists    = os.path.exists(video_path)
-    subtitle_exists = os.path.exists(subtitle_path)
-
-    if config.get("is_dry"):
-        if not subtitle_exists:
-            ydl_opts["skip_download"] = True
-        else:
-            print("[cyan][INFO][/]", "Skipped. Already exists.")
-            return
-    elif "apkg" in config.get("formats"):
-        if not video_exists:
-            ydl_opts["format"] = video_format_id
-        elif not subtitle_exists:
-            ydl_opts["skip_download"] = True
-        else:
-            print("[cyan][INFO][/]", "Skipped. Already exists.")
-            return
-    else:
-        if not subtitle_exists:
-            ydl_opts["skip_download"] = True
-        else:
-            print("[cyan][INFO][/]", "Skipped. Already exists.")
-            return
+    return ydl_opts
+
+
+def run_ydl(video_id: str, ydl_opts: dict):
+    # yt_dlp の import は重いため、実際にダウンロードするときだけ行う
+    from yt_dlp import YoutubeDL
 
     url = f"https://www.youtube.com/watch?v={video_id}"
 
@@ -53,3 +27,43 @@ def download(video_id: str, config):
     except Exception as e:
         print("[red][ERROR][/]", e)
         sys.exit(1)
+
+
+def download_subtitle(video_id: str, config):
+    subtitle_path = config.get("subtitle_path")
+
+    if os.path.exists(subtitle_path):
+        print("[cyan][INFO][/]", "Skipped. Subtitle already exists.")
+        return
+
+    ydl_opts = get_ydl_opts(config)
+    ydl_opts.update({
+        "writesubtitles": True,
+        "writeautomaticsub": True, # --write-auto-subs
+        "subtitleslangs": ["en.orig"],
+        "subtitlesformat": "srv2",
+        "skip_download": True,
+    })
+    run_ydl(video_id, ydl_opts)
+
+
+def download_video(video_id: str, config):
+    video_path = config.get("video_path")
+    video_format_id = "18"
+
+    # 動画はメディアを切り出すときだけ必要
+    if config.get("is_dry") or not "apkg" in config.get("formats"):
+        return
+
+    if os.path.exists(video_path):
+        print("[cyan][INFO][/]", "Skipped. Video already exists.")
+        return
+
+    ydl_opts = get_ydl_opts(config)
+    ydl_opts["format"] = video_format_id
+    run_ydl(video_id, ydl_opts)
+
+
+def download(video_id: str, config):
+    download_subtitle(video_id, config)
+    download_video(video_id, config)
@@ -1,5 +1,8 @@
+from array import array
 from datetime import timedelta
-from collections import UserList
+from collections.abc import Iterable, Iterator, Sequence
+
+import numpy as np
 
 def format_time(td: timedelta, delim: str = ".") -> str:
     """
@@ -52,43 +55,220 @@ class TimedWord:
         return hash((self._start, self._end, self._word))
 
 
-class Segment(UserList):
-    """時間情報を持つ単語のリストを表現するクラス"""
-    
-    def __init__(self, initlist: list[TimedWord] | None = None) -> None:
-        super().__init__(initlist)
-    
+def to_ms(td: timedelta) -> int:
+    return td // timedelta(milliseconds=1)
+
+
+def from_ms(ms: int) -> timedelta:
+    return timedelta(milliseconds=int(ms))
+
+
+class WordStore:
+    """単語列を列指向で保持するクラス
+
+    starts/ends は int64 のミリ秒配列、text は全単語をスペースでジョインした文字列、
+    offsets は各単語の text 上の開始位置（末尾に番兵 len(text) + 1 を持つ）。
+    """
+
+    __slots__ = ("starts", "ends", "text", "offsets")
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, text: str, offsets: np.ndarray) -> None:
+        self.starts = starts
+        self.ends = ends
+        self.text = text
+        self.offsets = offsets
+
+    @classmethod
+    def from_timedwords(cls, timedwords: Iterable[TimedWord]) -> "WordStore":
+        starts = array("q")
+        ends = array("q")
+        offsets = array("q")
+        words: list[str] = []
+        pos = 0
+        for w in timedwords:
+            starts.append(to_ms(w.start))
+            ends.append(to_ms(w.end))
+            offsets.append(pos)
+            words.append(w.word)
+            pos += len(w.word) + 1
+        offsets.append(pos)
+
+        return cls(
+            np.frombuffer(starts, dtype=np.int64),
+            np.frombuffer(ends, dtype=np.int64),
+            " ".join(words),
+            np.frombuffer(offsets, dtype=np.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def word(self, i: int) -> str:
+        return self.text[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def __getitem__(self, i: int) -> TimedWord:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("WordStore index out of range")
+        return TimedWord(from_ms(self.starts[i]), from_ms(self.ends[i]), self.word(i))
+
+    def __iter__(self) -> Iterator[TimedWord]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def view(self, lo: int = 0, hi: int | None = None) -> "Segment":
+        return Segment(store=self, lo=lo, hi=len(self) if hi is None else hi)
+
+    def word_index(self, chars: np.ndarray) -> np.ndarray:
+        """text 上の文字位置 -> その位置を含む語のインデックス（語間のスペースは直前の語）"""
+        return np.searchsorted(self.offsets, chars, side="right") - 1
+
+    def gap_breaks(self, min_gap_ms: int) -> np.ndarray:
+        """前の語の end から min_gap_ms 以上空いて始まる語のインデックス"""
+        gaps = self.starts[1:] - self.ends[:-1]
+        return np.flatnonzero(gaps >= min_gap_ms) + 1
+
+
+class Segment(Sequence):
+    """WordStore 上の区間 [lo, hi) を表現するクラス（コピーしないビュー）
+
+    リスト互換のため、TimedWord のリストからも生成できる。
+    start/end は margin 適用のために個別に上書きできる。
+    """
+
+    __slots__ = ("_store", "_lo", "_hi", "_start", "_end", "_sentence")
+
+    def __init__(
+        self,
+        initlist: Iterable[TimedWord] | None = None,
+        *,
+        store: WordStore | None = None,
+        lo: int = 0,
+        hi: int | None = None,
+        start: int | None = None,
+        end: int | None = None,
+    ) -> None:
+        if store is None:
+            if isinstance(initlist, Segment):
+                store, lo, hi = initlist._store, initlist._lo, initlist._hi
+                start, end = initlist._start, initlist._end
+            else:
+                store = WordStore.from_timedwords(initlist or [])
+                lo, hi = 0, len(store)
+        self._store = store
+        self._lo = lo
+        self._hi = len(store) if hi is None else hi
+        self._start = start
+        self._end = end
+        self._sentence: str | None = None
+
+    @property
+    def store(self) -> WordStore:
+        return self._store
+
+    @property
+    def lo(self) -> int:
+        return self._lo
+
+    @property
+    def hi(self) -> int:
+        return self._hi
+
+    def __len__(self) -> int:
+        return self._hi - self._lo
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            lo, hi, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(lo, hi, step)]
+            hi = max(lo, hi)
+            start = self._start if lo == 0 else None
+            end = self._end if hi == len(self) else None
+            return Segment(store=self._store, lo=self._lo + lo, hi=self._lo + hi, start=start, end=end)
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Segment index out of range")
+
+        word = self._store[self._lo + index]
+        if index == 0 and self._start is not None:
+            word = TimedWord(from_ms(self._start), word.end, word.word)
+        if index == len(self) - 1 and self._end is not None:
+            word = TimedWord(word.start, from_ms(self._end), word.word)
+        return word
+
+    def __iter__(self) -> Iterator[TimedWord]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Segment):
+            other = list(other)
+        if not isinstance(other, list):
+            return NotImplemented
+        return list(self) == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Segment({list(self)!r})"
+
     def __str__(self):
         start = format_time(self.start)
         end   = format_time(self.end)
         return f"{start}-{end} \"{self.sentence}\""
 
+    def with_bounds(self, start_ms: int, end_ms: int) -> "Segment":
+        """start/end を上書きした同じ区間のビュー"""
+        return Segment(store=self._store, lo=self._lo, hi=self._hi, start=start_ms, end=end_ms)
+
+    @property
+    def start_ms(self) -> int:
+        if self._start is None:
+            if not len(self):
+                raise ValueError("Segment is empty")
+            self._start = int(self._store.starts[self._lo])
+        return self._start
+
+    @property
+    def end_ms(self) -> int:
+        if self._end is None:
+            if not len(self):
+                raise ValueError("Segment is empty")
+            self._end = int(self._store.ends[self._hi - 1])
+        return self._end
+
     @property
     def start(self) -> timedelta:
         """先頭のTimedWordのstart"""
-        if not self.data:
-            raise ValueError("Segment is empty")
-        return self.data[0].start
-    
+        return from_ms(self.start_ms)
+
     @property
     def end(self) -> timedelta:
         """末尾のTimedWordのend"""
-        if not self.data:
-            raise ValueError("Segment is empty")
-        return self.data[-1].end
-    
+        return from_ms(self.end_ms)
+
     @property
     def sentence(self) -> str:
         """TimedWordのリストをスペースでジョイン"""
-        return " ".join(item.word for item in self.data)
-    
+        if self._sentence is None:
+            if not len(self):
+                self._sentence = ""
+            else:
+                offsets = self._store.offsets
+                self._sentence = self._store.text[offsets[self._lo]:offsets[self._hi] - 1]
+        return self._sentence
+
     @property
     def delta(self) -> timedelta:
         """endとstartの差"""
-        if self.start > self.end:
+        if self.start_ms > self.end_ms:
             print(self)
             raise ValueError("something weird")
-        return self.end - self.start
+        return from_ms(self.end_ms - self.start_ms)
 
 
 # 後方互換性のための型エイリアス
@@ -1,13 +1,25 @@
-import os, sys, subprocess, multiprocessing, shutil
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import os, sys, subprocess, multiprocessing, shutil, asyncio, itertools
+from collections.abc import Awaitable, Callable, Iterable, Iterator
+from concurrent.futures import Future
+from datetime import timedelta
 from rich import print
-from rich.progress import track, Progress
-import imageio_ffmpeg
+from rich.progress import Progress
 from y2a.entity import Segment
+from y2a.journal import DONE, FAILED, PENDING, Journal, get_part_path
+from y2a.scheduler import Job, Lane, run_lanes
 from y2a.utils import get_media_filename
 
 _FFMPEG_EXE = None
 
+# Number of segments written by one ffmpeg process
+AUDIO_BATCH_SIZE = 64
+IMAGE_BATCH_SIZE = 32
+# A larger gap between consecutive starts begins a new batch,
+# so one ffmpeg never decodes long stretches that no segment needs
+MAX_BATCH_GAP = timedelta(seconds=5)
+# Segments taken from a parsing iterator per hop to the worker thread
+STREAM_SEGMENTS = 32
+
 def get_ffmpeg_exe():
     """Return a path to an ffmpeg executable.
 
@@ -29,21 +41,24 @@ def get_ffmpeg_exe():
         return _FFMPEG_EXE
 
     # Fall back to imageio-ffmpeg
+    import imageio_ffmpeg
     _FFMPEG_EXE = imageio_ffmpeg.get_ffmpeg_exe()
     return _FFMPEG_EXE
 
 
-def extract_audio(video_path, is_debug):
+def extract_audio(video_path, is_debug, show_progress=True):
     print("[cyan][INFO][/]", "Extracting the entire audio...")
     audio_path = video_path.replace(".mp4", ".aac")
     # audio_path = video_path.replace(".mp4", ".wav")
+    part_path = get_part_path(audio_path)
     
     if os.path.exists(audio_path):
         print("[cyan][INFO][/]", "Skipped. Already exists.")
         return audio_path
 
     try:
-        with Progress() as p:
+        # Only one live display can be active, so background runs stay silent
+        with Progress(disable=not show_progress) as p:
             p.add_task("", total=None)
             # Select ffmpeg executable (system ffmpeg preferred)
             ffmpeg_path = get_ffmpeg_exe()
@@ -53,41 +68,37 @@ def extract_audio(video_path, is_debug):
                 "-i", video_path,
                 "-vn",
                 "-acodec", "copy",
-                audio_path
+                part_path
             ]
             
             if not is_debug:
                 cmd += ["-loglevel", "quiet"]
             
             subprocess.run(cmd, check=True)
+            # Rename only once fully written, so clips are never cut from a truncated audio
+            os.replace(part_path, audio_path)
     except Exception as e:
+        if os.path.exists(part_path):
+            os.remove(part_path)
         print("[red][ERROR][/]", f"Failed to extract audio: {e}")
         sys.exit(1)
 
     return audio_path
 
 
-def extract_seg_image(video_path, seg_image_path, ss, is_debug):
+def seg_image_cmd(video_path, seg_image_path, start, is_debug) -> list[str]:
+    """Build an ffmpeg command that grabs a single segment frame.
+
+    Used for isolated segments: the input-side -ss seeks straight to the
+    keyframe before `start` instead of decoding from a batch base.
+    """
     ffmpeg_path = get_ffmpeg_exe()
     width = -2
     height = 320
 
-    # Extract image frame
-
-    # JPEG
-    # cmd = [
-    #     ffmpeg_path, "-y",
-    #     "-ss", ss,
-    #     "-i", video_path,
-    #     "-frames:v", "1",
-    #     "-q:v", "2",
-    #     "-filter_complex", f"scale='min({width},iw)*sar':'min({height},ih)':out_color_matrix=bt601:out_range=pc",
-    #     seg_image_path,
-    # ]
-
     cmd = [
         ffmpeg_path, "-y",
-        "-ss", ss,
+        "-ss", str(start.total_seconds()),
         "-i", video_path,
         "-frames:v", "1",
         "-c:v", "libwebp",
@@ -95,32 +106,63 @@ def extract_seg_image(video_path, seg_image_path, ss, is_debug):
         "-filter_complex", f"scale='min({width},iw)*sar':'min({height},ih)':out_color_matrix=bt601:out_range=pc",
         seg_image_path,
     ]
-    
+
     if not is_debug:
         cmd += ["-loglevel", "quiet"]
-    
-    subprocess.run(cmd, check=True)
 
+    return cmd
+
+
+def seg_images_cmd(video_path, jobs, is_debug) -> list[str]:
+    """Build one ffmpeg command that grabs several segment frames.
 
-def extract_seg_audio(audio_path, seg_audio_path, ss, t, is_debug):
+    `jobs` is a list of (seg_image_path, start) sorted by start.
+    The video is seeked once to the first start and decoded linearly;
+    the scaled stream is split to one output per segment, and each
+    output keeps the first frame at or after its own -ss.
+    """
     ffmpeg_path = get_ffmpeg_exe()
+    width = -2
+    height = 320
+    base = jobs[0][1]
 
-    # Extract audio segment
+    labels = "".join(f"[v{i}]" for i in range(len(jobs)))
+    graph = (
+        f"[0:v]scale='min({width},iw)*sar':'min({height},ih)':out_color_matrix=bt601:out_range=pc,"
+        f"split={len(jobs)}{labels}"
+    )
 
-    # MP3
-    # cmd = [
-    #     ffmpeg_path, "-y",
-    #     "-ss", ss, "-t", t,
-    #     "-i", audio_path,
-    #     "-ac", "1",
-    #     "-c:a", "libmp3lame", "-b:a", "64k",
-    #     "-map_metadata", "-1",
-    #     seg_audio_path,
-    # ]
+    cmd = [
+        ffmpeg_path, "-y",
+        "-ss", str(base.total_seconds()),
+        "-i", video_path,
+        "-filter_complex", graph,
+    ]
+
+    for i, (seg_image_path, start) in enumerate(jobs):
+        ss = str((start - base).total_seconds())
+        cmd += [
+            "-map", f"[v{i}]",
+            "-ss", ss,
+            "-frames:v", "1",
+            "-c:v", "libwebp",
+            "-q:v", "80",
+            seg_image_path,
+        ]
+
+    if not is_debug:
+        cmd += ["-loglevel", "quiet"]
+
+    return cmd
+
+
+def seg_audio_cmd(audio_path, seg_audio_path, start, delta, is_debug) -> list[str]:
+    """Build an ffmpeg command that extracts a single audio segment."""
+    ffmpeg_path = get_ffmpeg_exe()
 
     cmd = [
         ffmpeg_path, "-y",
-        "-ss", ss, "-t", t,
+        "-ss", str(start.total_seconds()), "-t", str(delta.total_seconds()),
         "-i", audio_path,
         "-ac", "1",
         "-c:a", "libopus", "-b:a", "64k",
@@ -129,11 +171,188 @@ def extract_seg_audio(audio_path, seg_audio_path, ss, t, is_debug):
 
     if not is_debug:
         cmd += ["-loglevel", "quiet"]
-    
-    subprocess.run(cmd, check=True)
 
+    return cmd
+
+
+def seg_audios_cmd(audio_path, jobs, is_debug) -> list[str]:
+    """Build one ffmpeg command that extracts several audio segments.
+
+    `jobs` is a list of (seg_audio_path, start, delta) sorted by start.
+    The source is seeked once to the first start and decoded a single
+    time; each segment becomes its own output with output-side -ss/-t.
+    """
+    ffmpeg_path = get_ffmpeg_exe()
+    base = jobs[0][1]
+
+    cmd = [
+        ffmpeg_path, "-y",
+        "-ss", str(base.total_seconds()),
+        "-i", audio_path,
+    ]
+
+    for seg_audio_path, start, delta in jobs:
+        ss = str((start - base).total_seconds())
+        t = str(delta.total_seconds())
+        cmd += [
+            "-map", "0:a",
+            "-ss", ss, "-t", t,
+            "-ac", "1",
+            "-c:a", "libopus", "-b:a", "64k",
+            seg_audio_path,
+        ]
+
+    if not is_debug:
+        cmd += ["-loglevel", "quiet"]
+
+    return cmd
+
+
+def batch_cost(jobs) -> float:
+    """
+    Rough cost of a batch: seconds of media decoded plus one unit per output
+    """
+    span = (jobs[-1][1] - jobs[0][1]).total_seconds()
+    return span + len(jobs)
+
+
+class BatchBuilder:
+    """Group jobs arriving in order of start (job[1]) into batches
+
+    A batch holds up to `size` segments; a new one begins wherever
+    consecutive starts are more than `max_gap` apart, or go backwards
+    (each batch seeks once to its first start).
+    """
+
+    __slots__ = ("size", "max_gap", "batch")
+
+    def __init__(self, size: int, max_gap: timedelta = MAX_BATCH_GAP) -> None:
+        self.size = size
+        self.max_gap = max_gap
+        self.batch = []
+
+    def add(self, job) -> list | None:
+        """Add a job; return the batch it closed, if any"""
+        closed = None
+        if self.batch:
+            gap = job[1] - self.batch[-1][1]
+            if len(self.batch) >= self.size or gap > self.max_gap or gap < timedelta(0):
+                closed = self.batch
+                self.batch = []
+        self.batch.append(job)
+        return closed
+
+    def flush(self) -> list | None:
+        """Return the last open batch, if any"""
+        closed = self.batch or None
+        self.batch = []
+        return closed
+
+
+def get_batches(jobs, size: int, max_gap: timedelta = MAX_BATCH_GAP) -> list[list]:
+    """
+    Group jobs (sorted by start, job[1]) into batches of up to `size` segments,
+    starting a new batch wherever consecutive starts are more than `max_gap` apart
+    """
+    builder = BatchBuilder(size, max_gap)
+    batches = [batch for job in jobs if (batch := builder.add(job))]
+    if batch := builder.flush():
+        batches.append(batch)
+    return batches
+
+
+def get_lane_limits(config) -> tuple[int, int]:
+    """
+    Concurrent ffmpeg processes for the image and audio lanes (0 = auto)
+    """
+    auto = max(1, multiprocessing.cpu_count() // 2)
+    image_limit = config.get("image_jobs") or auto
+    audio_limit = config.get("audio_jobs") or auto
+    return image_limit, audio_limit
+
+
+def get_media_files(segments: list[Segment], config) -> list[str]:
+    video_id  = config.get("video_id")
+    audio_ext = config.get("audio_ext")
+    image_ext = config.get("image_ext")
+    out_dir = f"{video_id}/media"
+
+    media_files = []
+    for seg in segments:
+        for ext in (image_ext, audio_ext):
+            name = get_media_filename(video_id, seg.start, seg.end, ext)
+            media_files.append(os.path.join(out_dir, name))
+    return media_files
+
+
+def make_finish(journal: Journal, paths: list[str]):
+    """
+    Build a Job.finish that renames each non-empty temp output into place
+    and journals it as done; outputs ffmpeg did not write are marked failed
+    """
+    def finish(returncode: int) -> bool:
+        done = []
+        missing = []
+        for path in paths:
+            part = get_part_path(path)
+            if os.path.exists(part) and os.path.getsize(part) > 0:
+                os.replace(part, path)
+                done.append(path)
+            else:
+                if os.path.exists(part):
+                    os.remove(part)
+                missing.append(path)
+
+        if done:
+            journal.mark(done, DONE)
+        for path in missing:
+            journal.mark([path], FAILED, code=returncode, attempts=journal.attempts(path) + 1)
+        return not missing
+
+    return finish
+
+
+def remove_orphaned_media(media_files: list[str], config):
+    """
+    Delete media of this video that no segment refers to anymore
+    (e.g. left behind by a previous --margin or --max_duration,
+    or temp outputs of a run that crashed)
+    """
+    video_id = config.get("video_id")
+    out_dir = f"{video_id}/media"
+    if not os.path.isdir(out_dir):
+        return
+
+    prefix = f"y2a-{video_id}_"
+    keep = {os.path.basename(path) for path in media_files}
+    removed = 0
+    for name in os.listdir(out_dir):
+        if name.startswith(prefix) and name not in keep:
+            os.remove(os.path.join(out_dir, name))
+            removed += 1
+
+    if removed:
+        print("[cyan][INFO][/]", f"Removed {removed:,} orphaned media files.")
+
+
+def extract(
+    segments: Iterable[Segment],
+    config,
+    audio_future: Future | None = None,
+    video_future: Future | None = None,
+):
+    """
+    Cut an image and an audio clip for each segment.
+
+    When `audio_future` is given, the entire audio is being extracted
+    elsewhere; image jobs start right away and audio jobs follow once
+    the future resolves to the audio path.
 
-def extract(segments: list[Segment], config):
+    `segments` may also be an iterator that is still parsing. It is then
+    advanced in a worker thread, and the clips of the segments it has
+    produced so far are cut while it runs. Image jobs wait for
+    `video_future` (the video download), if given.
+    """
     video_id   = config.get("video_id")
     video_path = config.get("video_path")
     is_debug   = config.get("is_debug")
@@ -147,57 +366,195 @@ def extract(segments: list[Segment], config):
         print("[cyan][INFO][/]", "Skipped.")
         return []
 
-    audio_path = extract_audio(video_path, is_debug)
+    audio_path = None
+    if audio_future is None:
+        audio_path = extract_audio(video_path, is_debug)
 
     out_dir = f"{video_id}/media"
     os.makedirs(out_dir, exist_ok=True)
 
-    existing_files = set(os.listdir(out_dir))
+    # Only outputs journaled as done (with their size unchanged) are skipped
+    journal = Journal.load(out_dir)
     media_files = []
 
-    tasks = []
-    for seg in segments:
-        start = seg.start
-        end   = seg.end
-        delta = seg.delta
-
-        image_name = get_media_filename(video_id, start, end, image_ext)
-        audio_name = get_media_filename(video_id, start, end, audio_ext)
+    def _pending(seg: Segment) -> tuple[tuple | None, tuple | None]:
+        """Record the clips of a segment; return the image/audio jobs still to run"""
+        image_name = get_media_filename(video_id, seg.start, seg.end, image_ext)
+        audio_name = get_media_filename(video_id, seg.start, seg.end, audio_ext)
         seg_image_path = os.path.join(out_dir, image_name)
         seg_audio_path = os.path.join(out_dir, audio_name)
         media_files.append(seg_image_path)
         media_files.append(seg_audio_path)
 
-        ss = str(start.total_seconds())
-        t = str(delta.total_seconds())
-
-        if not image_name in existing_files:
-            tasks.append((
-                extract_seg_image,
-                video_path, seg_image_path, ss, is_debug))
-        
-        if not audio_name in existing_files:
-            tasks.append((
-                extract_seg_audio,
-                audio_path, seg_audio_path, ss, t, is_debug))
-
-    cpu_count = multiprocessing.cpu_count()
-    max_workers = max(1, min(cpu_count // 2, 4)) 
+        image_job = None if journal.is_done(seg_image_path) else (seg_image_path, seg.start)
+        audio_job = None if journal.is_done(seg_audio_path) else (seg_audio_path, seg.start, seg.delta)
+        return image_job, audio_job
+
+    # ffmpeg writes to temp paths; finish renames each output once it is written,
+    # and a failed batch is retried one missing segment at a time
+    def _image_job(batch) -> Job:
+        parts = [(get_part_path(path), start) for path, start in batch]
+        paths = [path for path, _ in batch]
+        if len(batch) == 1:
+            return Job(seg_image_cmd(video_path, *parts[0], is_debug), batch_cost(batch), batch[0][0],
+                       finish=make_finish(journal, paths))
+        return Job(seg_images_cmd(video_path, parts, is_debug), batch_cost(batch), batch[0][0],
+                   finish=make_finish(journal, paths),
+                   split=lambda: [_image_job([job]) for job in batch if not journal.is_done(job[0])])
+
+    def _audio_job(path, batch) -> Job:
+        parts = [(get_part_path(p), start, delta) for p, start, delta in batch]
+        paths = [p for p, _, _ in batch]
+        if len(batch) == 1:
+            return Job(seg_audio_cmd(path, *parts[0], is_debug), batch_cost(batch), batch[0][0],
+                       finish=make_finish(journal, paths))
+        return Job(seg_audios_cmd(path, parts, is_debug), batch_cost(batch), batch[0][0],
+                   finish=make_finish(journal, paths),
+                   split=lambda: [_audio_job(path, [job]) for job in batch if not journal.is_done(job[0])])
+
+    # Each lane waits for its input (the video, the entire audio) before its first job
+    async def _image_factory() -> Callable[[list], Job]:
+        if video_future is not None:
+            await asyncio.wrap_future(video_future)
+        return _image_job
+
+    async def _audio_factory() -> Callable[[list], Job]:
+        path = audio_path
+        if path is None:
+            path = await asyncio.wrap_future(audio_future)
+        return lambda batch: _audio_job(path, batch)
+
+    image_limit, audio_limit = get_lane_limits(config)
+
+    if isinstance(segments, list):
+        image_jobs = []
+        audio_jobs = []
+        for seg in segments:
+            image_job, audio_job = _pending(seg)
+            if image_job is not None:
+                image_jobs.append(image_job)
+            if audio_job is not None:
+                audio_jobs.append(audio_job)
+
+        # Batch nearby segments so each part of the media is decoded only once
+        image_jobs.sort(key=lambda job: job[1])
+        image_batches = get_batches(image_jobs, IMAGE_BATCH_SIZE)
+
+        audio_jobs.sort(key=lambda job: job[1])
+        audio_batches = get_batches(audio_jobs, AUDIO_BATCH_SIZE)
+
+        journal.mark([job[0] for job in image_jobs + audio_jobs], PENDING)
+
+        image_lane = Lane("image", image_limit, jobs=[_image_job(batch) for batch in image_batches])
+
+        async def _audio_jobs() -> list[Job]:
+            if not audio_batches:
+                return []
+            make_job = await _audio_factory()
+            return [make_job(batch) for batch in audio_batches]
+
+        audio_lane = Lane("audio", audio_limit, source=_audio_jobs)
+        feed = None
+        total = len(image_batches) + len(audio_batches)
+    else:
+        image_lane, audio_lane, feed = _stream_lanes(
+            iter(segments), _pending, journal,
+            (image_limit, _image_factory),
+            (audio_limit, _audio_factory),
+        )
+        total = None
 
     print("[cyan][INFO][/]", "Extracting for each segment...")
-    with ThreadPoolExecutor(max_workers=max_workers) as ex:
-        try:
-            futures = [ex.submit(*task) for task in tasks]
-
-            for f in track(as_completed(futures), total=len(futures), description=""):
-                try:
-                    f.result()
-                except Exception as e:
-                    print("[red][ERROR][/]", "Extraction failed:", e)
+    with Progress() as p:
+        task = p.add_task("", total=total)
+
+        async def _run() -> list[Job]:
+            if feed is None:
+                return await run_lanes([image_lane, audio_lane], on_done=lambda job: p.advance(task))
+            # Batches appear as segments are parsed; the bar grows with them
+            feeding = asyncio.create_task(feed(lambda n: p.update(task, total=n)))
+            failed = await run_lanes([image_lane, audio_lane], on_done=lambda job: p.advance(task))
+            await feeding
+            return failed
 
+        try:
+            failed = asyncio.run(_run())
         except KeyboardInterrupt:
+            # Running ffmpeg processes were killed on cancel (temp outputs are cleaned up next run)
             print("[red][ERROR][/]", "Shutting down...")
-            ex.shutdown(wait=False, cancel_futures=True)
             sys.exit(1)
 
+    remove_orphaned_media(media_files, config)
+    journal.compact({os.path.basename(path) for path in media_files})
+
+    # Never hand broken or missing clips to the package writer
+    if failed:
+        done = [path for path in media_files if journal.is_done(path)]
+        print("[red][ERROR][/]", f"{len(media_files) - len(done):,} media files failed. Run again to retry them.")
+        return done
+
     return media_files
+
+
+async def _iter_jobs(batches: asyncio.Queue, get_factory: Callable[[], Awaitable[Callable[[list], Job]]]):
+    """
+    Turn queued batches into jobs until the None sentinel, waiting for the
+    lane's input only once there is work for it
+    """
+    batch = await batches.get()
+    if batch is None:
+        return
+    make_job = await get_factory()
+    while batch is not None:
+        yield make_job(batch)
+        batch = await batches.get()
+
+
+def _stream_lanes(segments: Iterator[Segment], pending, journal: Journal, image, audio):
+    """
+    Build the image/audio lanes for segments that are still being produced,
+    and the coroutine that feeds them. `image` and `audio` are
+    (limit, async function returning the job factory) of each lane.
+
+    The iterator is advanced in a worker thread, a few segments at a time,
+    so ffmpeg jobs keep starting while it runs. Batches are closed as soon
+    as the next segment is too far away (see BatchBuilder).
+    """
+    (image_limit, image_factory), (audio_limit, audio_factory) = image, audio
+    image_batches: asyncio.Queue = asyncio.Queue()
+    audio_batches: asyncio.Queue = asyncio.Queue()
+    image_lane = Lane("image", image_limit, stream=lambda: _iter_jobs(image_batches, image_factory))
+    audio_lane = Lane("audio", audio_limit, stream=lambda: _iter_jobs(audio_batches, audio_factory))
+
+    async def feed(on_total: Callable[[int], None]):
+        builders = [
+            (BatchBuilder(IMAGE_BATCH_SIZE), image_batches),
+            (BatchBuilder(AUDIO_BATCH_SIZE), audio_batches),
+        ]
+        n_batches = 0
+
+        def _put(batch, queue: asyncio.Queue):
+            nonlocal n_batches
+            journal.mark([job[0] for job in batch], PENDING)
+            queue.put_nowait(batch)
+            n_batches += 1
+            on_total(n_batches)
+
+        try:
+            while True:
+                chunk = await asyncio.to_thread(lambda: list(itertools.islice(segments, STREAM_SEGMENTS)))
+                if not chunk:
+                    break
+                for seg in chunk:
+                    for job, (builder, queue) in zip(pending(seg), builders):
+                        if job is not None and (batch := builder.add(job)):
+                            _put(batch, queue)
+            for builder, queue in builders:
+                if batch := builder.flush():
+                    _put(batch, queue)
+        finally:
+            # The lanes stop once they drain what was queued (also on a parse error)
+            image_batches.put_nowait(None)
+            audio_batches.put_nowait(None)
+
+    return image_lane, audio_lane, feed
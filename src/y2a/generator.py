@@ -1,7 +1,7 @@
-import os, random
+import os, json, time, hashlib
+from collections.abc import Iterable, Iterator
 
 from rich import print
-import genanki
 
 from y2a.entity import Segment
 from y2a.utils import (
@@ -32,10 +32,13 @@ def load_templates():
 
 
 def create_notes(segments: list[Segment], config) -> list[dict]:
+    return list(iter_notes(segments, config))
+
+
+def iter_notes(segments: Iterable[Segment], config) -> Iterator[dict]:
     video_id = config.get("video_id")
     audio_ext = config.get("audio_ext")
     image_ext = config.get("image_ext")
-    notes: list[dict] = []
 
     for segment in segments:
         start = segment.start
@@ -54,7 +57,7 @@ def create_notes(segments: list[Segment], config) -> list[dict]:
         image_tag   = f"<img src=\"{image_file}\">"
         url         = f"https://www.youtube.com/watch?v={video_id}&start={start_sec}&end={end_sec}"
 
-        notes.append({
+        yield {
             "id":          note_id,
             "sentence":    sentence,
             "translation": translation,
@@ -65,17 +68,19 @@ def create_notes(segments: list[Segment], config) -> list[dict]:
             "audio":       audio_tag,
             "image":       image_tag,
             "url":         url,
-        })
-        
-    return notes
+        }
 
 
-def write_in_apkg(notes: list[dict], media: list[str], config):
-    video_id = config.get("video_id")
+MODEL_ID = 1759125590781
+
+
+def get_model():
+    import genanki
+
     front, back, style = load_templates()
-    
-    model = genanki.Model(
-        1759125590781,
+
+    return genanki.Model(
+        MODEL_ID,
         "y2a",
         fields=[
             {"name": "id"},
@@ -98,41 +103,248 @@ def write_in_apkg(notes: list[dict], media: list[str], config):
         css=style,
     )
 
-    deck_id = random.randrange(1 << 30, 1 << 31)
+
+def get_deck_id(deck_name: str) -> int:
+    """
+    デッキ名から決まる ID（genanki の乱数と同じ範囲）。作り直しても同じデッキに入る
+    """
+    digest = hashlib.sha256(f"y2a-deck:{deck_name}".encode("utf-8")).digest()
+    return (1 << 30) + int.from_bytes(digest[:8], "big") % (1 << 30)
+
+
+def get_note_guid(note: dict) -> str:
+    """
+    get_note_id のキー（動画と区間）から決まる GUID。内容が変わっても同じノートを更新する
+    """
+    import genanki
+
+    return genanki.guid_for("y2a", note["id"])
+
+
+def get_note_digest(row: list[str]) -> str:
+    return hashlib.sha256("\x1f".join(row).encode("utf-8")).hexdigest()[:16]
+
+
+def get_exported_path(video_id: str) -> str:
+    return f"{video_id}/{video_id}.exported.json"
+
+
+def load_exported(video_id: str) -> dict[str, str]:
+    """
+    書き出し済みのノート（GUID -> 内容のダイジェスト）
+    """
+    file_path = get_exported_path(video_id)
+    if not os.path.exists(file_path):
+        return {}
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("notes", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_exported(video_id: str, notes: dict[str, str]):
+    file_path = get_exported_path(video_id)
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"notes": notes}, f)
+    os.replace(tmp_path, file_path)
+
+
+def write_in_apkg(notes: Iterable[dict], media: list[str], config):
+    """
+    --delta では、前回の書き出しから増えた・変わったノートとそのメディアだけを
+    更新用のパッケージに書き出す（GUID が同じなので Anki 側では上書きになる）
+    """
+    import genanki
+    from y2a.apkg import write_package
+
+    video_id = config.get("video_id")
+    is_delta = config.get("is_delta")
+    model = get_model()
 
     deck = genanki.Deck(
-        deck_id,
+        get_deck_id(video_id),
         f"{video_id}"
     )
 
     keys = [f["name"] for f in model.fields]
+    exported = load_exported(video_id) if is_delta else {}
+    current = {}
+    written = {}
+    rows = []
+    media_names = set()
     for n in notes:
         row = [n.get(key) for key in keys]
-        anki_note = genanki.Note(
-            model=model,
-            fields=row,
-        )
-        deck.add_note(anki_note)
+        guid = get_note_guid(n)
+        digest = get_note_digest(row)
+        if exported.get(guid) == digest:
+            current[guid] = digest
+            continue
+        rows.append((deck.deck_id, guid, row))
+        files = (n.get("audio_file"), n.get("image_file"))
+        media_names.update(files)
+        written[guid] = (digest, files)
+
+    if is_delta:
+        if not rows:
+            print("[cyan][INFO][/]", "Skipped. No new or changed notes.")
+            save_exported(video_id, current)
+            return
+        media = [path for path in media if os.path.basename(path) in media_names]
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        apkg_path = f"{video_id}/{video_id}.update-{stamp}.apkg"
+    else:
+        apkg_path = f"{video_id}/{video_id}.apkg"
 
-    package = genanki.Package(deck)
-    package.media_files = media
+    write_package(apkg_path, model, [deck], rows, media)
 
-    apkg_path = f"{video_id}/{video_id}.apkg"
-    package.write_to_file(apkg_path)
+    # メディアが両方ともパッケージに入ったノートだけを書き出し済みとする
+    # （欠けたノートは次回の --delta で書き出し直す）
+    packed = {os.path.basename(path) for path in media}
+    for guid, (digest, files) in written.items():
+        if all(name in packed for name in files):
+            current[guid] = digest
+    save_exported(video_id, current)
     
-    print("[cyan][INFO][/]", f"[green]Anki package created: {apkg_path}")
+    print("[cyan][INFO][/]", f"[green]Anki package created: {apkg_path}", f"({len(rows):,} notes)")
 
 
-def generate(segments: list[Segment], media: list[str], config) -> list[dict]:
-    notes = create_notes(segments, config)
+# マージしたパッケージ 1 つあたりの上限（Anki の取り込みが重くならない大きさ）
+SHARD_MAX_BYTES = 500 << 20
+# メディア以外（collection.anki2 の行と zip のエントリ）のノート 1 件あたりの見積もり
+NOTE_BYTES = 1 << 10
 
+# (GUID, フィールド, メディアのパス)
+MergedNote = tuple[str, list[str], list[str]]
+
+
+def load_video_notes(config) -> tuple[list[MergedNote], int]:
+    """
+    処理済みの動画（manifest の分割結果と書き出し済みのメディア）からノートを作る
+
+    メディアが揃っていない（ジャーナルで done でない）ノートは除き、その件数も返す。
+    """
+    from y2a.journal import Journal
+    from y2a.manifest import Manifest, load_segments
+    from y2a.parser import parse_into_word_store
+
+    video_id = config.get("video_id")
+    record = Manifest.load(video_id).stages.get("parse")
+    if record is None:
+        raise FileNotFoundError(f"No parsed segments. Run `y2a {video_id}` first.")
+
+    store = parse_into_word_store(config.get("subtitle_path"))
+    segments = load_segments(store, record["segments"])
+
+    out_dir = f"{video_id}/media"
+    journal = Journal.load(out_dir)
+    keys = [f["name"] for f in get_model().fields]
+
+    notes = []
+    skipped = 0
+    for n in iter_notes(segments, config):
+        paths = [os.path.join(out_dir, n.get(key)) for key in ("audio_file", "image_file")]
+        if not all(journal.is_done(path) for path in paths):
+            skipped += 1
+            continue
+        notes.append((get_note_guid(n), [n.get(key) for key in keys], paths))
+    return notes, skipped
+
+
+def split_into_shards(
+    videos: list[tuple[str, list[MergedNote]]],
+    max_bytes: int,
+) -> list[list[tuple[str, MergedNote]]]:
+    """
+    ノートを順に詰め、見積もりサイズが max_bytes を超える手前でパッケージを分ける
+
+    ノートとそのメディアは同じパッケージに入れる（1 件で上限を超える場合はそれだけで 1 つ）。
+    """
+    shards = []
+    shard = []
+    size = 0
+    for video_id, notes in videos:
+        for note in notes:
+            note_size = NOTE_BYTES + sum(os.path.getsize(path) for path in note[2])
+            if shard and size + note_size > max_bytes:
+                shards.append(shard)
+                shard = []
+                size = 0
+            shard.append((video_id, note))
+            size += note_size
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+def get_shard_path(file_path: str, index: int, count: int) -> str:
+    if count == 1:
+        return file_path
+    root, ext = os.path.splitext(file_path)
+    return f"{root}-{index:02d}{ext}"
+
+
+def write_merged_packages(
+    videos: list[tuple[str, list[MergedNote]]],
+    deck_name: str,
+    file_path: str,
+    max_bytes: int = SHARD_MAX_BYTES,
+) -> list[str]:
+    """
+    複数の動画のノートを「deck_name::video_id」のデッキに分けて 1 つのパッケージにまとめる
+
+    見積もりサイズが max_bytes を超える場合は file_path-01.apkg, -02.apkg, ... に分ける。
+    デッキ ID と GUID は動画毎のパッケージと同じなので、どちらで取り込んでも同じノートになる。
+    """
+    import genanki
+    from y2a.apkg import write_package
+
+    model = get_model()
+    shards = split_into_shards(videos, max_bytes)
+
+    paths = []
+    for index, shard in enumerate(shards, start=1):
+        decks = {deck_name: genanki.Deck(get_deck_id(deck_name), deck_name)}
+        rows = []
+        media = []
+        for video_id, (guid, row, files) in shard:
+            name = f"{deck_name}::{video_id}"
+            if name not in decks:
+                decks[name] = genanki.Deck(get_deck_id(name), name)
+            rows.append((decks[name].deck_id, guid, row))
+            media.extend(files)
+
+        apkg_path = get_shard_path(file_path, index, len(shards))
+        write_package(apkg_path, model, list(decks.values()), rows, media)
+        paths.append(apkg_path)
+
+        size = os.path.getsize(apkg_path)
+        print(
+            "[cyan][INFO][/]", f"[green]Anki package created: {apkg_path}",
+            f"({len(rows):,} notes, {len(decks) - 1:,} decks, {size / (1 << 20):,.1f} MB)",
+        )
+
+    return paths
+
+
+def generate(segments: list[Segment], media: list[str], config):
     if config.get("is_dry"):
         print("[yellow][DRY][/]", "Skipped.")
-        return notes
+        return
     if not "apkg" in config.get("formats"):
         print("[cyan][INFO][/]", "Skipped.")
-        return notes
+        return
 
-    write_in_apkg(notes, media, config)
-    
-    return notes
\ No newline at end of file
+    # 切り出しに失敗したメディアを参照するノートは、パッケージに入れない
+    names = {os.path.basename(path) for path in media}
+    notes = [
+        n for n in iter_notes(segments, config)
+        if n.get("audio_file") in names and n.get("image_file") in names
+    ]
+    if len(notes) < len(segments):
+        print("[yellow][WARN][/]", f"{len(segments) - len(notes):,} notes without media files are left out.")
+        names = {name for n in notes for name in (n.get("audio_file"), n.get("image_file"))}
+        media = [path for path in media if os.path.basename(path) in names]
+
+    write_in_apkg(notes, media, config)
\ No newline at end of file
@@ -0,0 +1,174 @@
+import os, json
+from typing import TYPE_CHECKING
+import numpy as np
+
+if TYPE_CHECKING:
+    from spacy.tokens.doc import Doc
+    from spacy.vocab import Vocab
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), "rules", "grammar.json")
+
+# none: 分割しない（優先度の低いルールも適用しない）
+# before: 対象トークンの直前で分割
+# after: 対象トークンの直後で分割
+# before_or_first_comma: 直前で分割、文頭の場合は同じ文の最初のカンマの直後で分割
+ACTIONS = ("none", "before", "after", "before_or_first_comma")
+
+# パターン中で分割位置を決めるトークンの RIGHT_ID
+TARGET_ID = "target"
+
+# パイプラインが付与する属性（解析されていない Doc では照合できない）
+ANNOTATIONS = ("DEP", "POS", "TAG", "MORPH", "LEMMA")
+
+_COMPILED: dict[tuple[str, int], "GrammarRules"] = {}
+
+
+def get_rules_path(config) -> str:
+    return config.get("grammar_rules") or DEFAULT_RULES_PATH
+
+
+def load_rules(file_path: str) -> list[dict]:
+    with open(file_path, "r", encoding="utf-8") as f:
+        rules = json.load(f).get("rules", [])
+
+    names = set()
+    for rule in rules:
+        name = rule.get("name")
+        if not name or name in names:
+            raise ValueError(f"Rule name is missing or duplicated: {name!r}")
+        if rule.get("action") not in ACTIONS:
+            raise ValueError(f"Unknown action in rule {name!r}: {rule.get('action')!r}")
+        for pattern in rule.get("patterns", []):
+            if not any(node.get("RIGHT_ID") == TARGET_ID for node in pattern):
+                raise ValueError(f"Pattern without {TARGET_ID!r} node in rule {name!r}")
+        names.add(name)
+
+    return rules
+
+
+def get_required_annotations(pattern: list[dict]) -> frozenset[str]:
+    """
+    パターンの照合に必要な解析結果（Doc.has_annotation の属性名）
+    """
+    required = set()
+    if len(pattern) > 1:
+        required.add("DEP")
+    for node in pattern:
+        for attr in node.get("RIGHT_ATTRS", {}):
+            if attr.upper() in ANNOTATIONS:
+                required.add(attr.upper())
+    return frozenset(required)
+
+
+def get_sentence_index(doc: "Doc") -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    トークン毎の文頭位置と、その文の最初のカンマ位置（なければ -1）を一括で求める
+    """
+    from spacy.attrs import ORTH, SENT_START
+
+    if not len(doc) or not doc.has_annotation("SENT_START"):
+        return None
+
+    values = doc.to_array([SENT_START, ORTH])
+    is_start = values[:, 0] == 1
+    is_start[0] = True
+
+    starts = np.flatnonzero(is_start)
+    sent_ids = np.cumsum(is_start) - 1
+
+    first_comma_of_sent = np.full(len(starts), -1, dtype=np.int64)
+    commas = np.flatnonzero(values[:, 1] == doc.vocab.strings[","])
+    # 文毎に最初に現れるカンマ
+    ids, first = np.unique(sent_ids[commas], return_index=True)
+    first_comma_of_sent[ids] = commas[first]
+
+    return starts[sent_ids], first_comma_of_sent[sent_ids]
+
+
+class GrammarRules:
+    """ルールを Matcher / DependencyMatcher に一度だけコンパイルしたもの
+
+    ルールはファイル内の順に優先され、一つのトークンには最も優先度の高い
+    ルールだけが適用される。
+    """
+
+    __slots__ = ("names", "actions", "keys", "matchers")
+
+    def __init__(self, rules: list[dict], vocab: "Vocab") -> None:
+        from spacy.matcher import DependencyMatcher, Matcher
+
+        self.names = [rule["name"] for rule in rules]
+        self.actions = [rule["action"] for rule in rules]
+        # matcher のキー -> (優先度, パターン中の対象トークンの位置)
+        self.keys: dict[int, tuple[int, int]] = {}
+        # 必要な解析結果の組 -> (Matcher, DependencyMatcher)
+        # 1 トークンだけのパターンは、より軽い Matcher で照合する
+        self.matchers: dict[frozenset[str], tuple["Matcher", "DependencyMatcher"]] = {}
+
+        for priority, rule in enumerate(rules):
+            for j, pattern in enumerate(rule.get("patterns", [])):
+                key = f"{rule['name']}#{j}"
+                target = next(k for k, node in enumerate(pattern) if node.get("RIGHT_ID") == TARGET_ID)
+
+                required = get_required_annotations(pattern)
+                if required not in self.matchers:
+                    self.matchers[required] = (Matcher(vocab), DependencyMatcher(vocab))
+                token_matcher, dep_matcher = self.matchers[required]
+
+                if len(pattern) == 1:
+                    token_matcher.add(key, [[pattern[0].get("RIGHT_ATTRS", {})]])
+                else:
+                    dep_matcher.add(key, [pattern])
+                self.keys[vocab.strings[key]] = (priority, target)
+
+    def iter_matches(self, doc: "Doc"):
+        """(優先度, 対象トークンの位置) を yield する"""
+        for required, (token_matcher, dep_matcher) in self.matchers.items():
+            # 解析されていない属性を参照するパターンは一致しないものとして扱う
+            if not all(doc.has_annotation(attr) for attr in required):
+                continue
+            if len(token_matcher):
+                for match_id, start, _ in token_matcher(doc):
+                    yield self.keys[match_id][0], start
+            if len(dep_matcher):
+                for match_id, token_ids in dep_matcher(doc):
+                    priority, target = self.keys[match_id]
+                    yield priority, token_ids[target]
+
+    def find_boundaries(self, doc: "Doc") -> set:
+        # トークン毎に、マッチしたルールのうち最も優先度の高いもの
+        best: dict[int, int] = {}
+        for priority, i in self.iter_matches(doc):
+            if priority < best.get(i, len(self.actions)):
+                best[i] = priority
+
+        index = None
+        if "before_or_first_comma" in self.actions:
+            index = get_sentence_index(doc)
+
+        split_points = set()
+        for i, priority in best.items():
+            action = self.actions[priority]
+            if action == "after":
+                split_points.add(i)
+            elif action == "before":
+                split_points.add(i - 1 if i - 1 >= 0 else i)
+            elif action == "before_or_first_comma":
+                if index is None:
+                    continue
+                sent_starts, first_commas = index
+                if i > sent_starts[i]:
+                    split_points.add(i - 1)
+                elif first_commas[i] >= 0:
+                    # "If I go there, I can..." のように文頭にある場合
+                    split_points.add(int(first_commas[i]))
+
+        return split_points
+
+
+def get_grammar_rules(vocab: "Vocab", file_path: str = DEFAULT_RULES_PATH) -> GrammarRules:
+    # 同一プロセス内では、ルールファイルと語彙毎にコンパイル済みのものを使い回す
+    key = (file_path, id(vocab))
+    if key not in _COMPILED:
+        _COMPILED[key] = GrammarRules(load_rules(file_path), vocab)
+    return _COMPILED[key]
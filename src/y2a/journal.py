@@ -0,0 +1,86 @@
+import os, json
+
+# ジョブの状態
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+def get_part_path(file_path: str) -> str:
+    """
+    書き出し途中の一時ファイル（ffmpeg が形式を判断できるよう拡張子は残す）
+    """
+    root, ext = os.path.splitext(file_path)
+    return f"{root}.part{ext}"
+
+
+class Journal:
+    """メディアファイル毎の書き出し結果を JSONL に追記していくクラス
+
+    最後に書かれた行がそのファイルの状態になる。done の行には書き出した
+    サイズを残し、サイズが変わった（消された・壊れた）ファイルはやり直す。
+    """
+
+    def __init__(self, file_path: str, entries: dict[str, dict] | None = None) -> None:
+        self.file_path = file_path
+        self.entries = entries or {}
+
+    @classmethod
+    def load(cls, out_dir: str) -> "Journal":
+        file_path = os.path.join(out_dir, ".journal.jsonl")
+        entries = {}
+        if os.path.exists(file_path):
+            with open(file_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 追記の途中で落ちた最後の行
+                        continue
+                    entries[entry["name"]] = entry
+        return cls(file_path, entries)
+
+    def is_done(self, file_path: str) -> bool:
+        entry = self.entries.get(os.path.basename(file_path))
+        if entry is None or entry.get("state") != DONE:
+            return False
+        try:
+            return os.path.getsize(file_path) == entry.get("size")
+        except OSError:
+            return False
+
+    def attempts(self, file_path: str) -> int:
+        entry = self.entries.get(os.path.basename(file_path))
+        return entry.get("attempts", 0) if entry else 0
+
+    def mark(self, file_paths: list[str], state: str, **data):
+        """
+        ファイル群の状態を一度に追記する（done の場合はサイズも記録する）
+        """
+        lines = []
+        for file_path in file_paths:
+            name = os.path.basename(file_path)
+            entry = {"name": name, "state": state, **data}
+            if state == DONE:
+                entry["size"] = os.path.getsize(file_path)
+            self.entries[name] = entry
+            lines.append(json.dumps(entry) + "\n")
+
+        with open(self.file_path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self, keep: set[str] | None = None):
+        """
+        各ファイルの最新の行だけを残して書き直す（keep 以外の記録は捨てる）
+        """
+        entries = self.entries
+        if keep is not None:
+            entries = {name: e for name, e in entries.items() if name in keep}
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self.file_path)
+        self.entries = entries
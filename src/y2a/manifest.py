@@ -0,0 +1,102 @@
+import os, json, hashlib
+from datetime import timedelta
+
+from y2a.entity import Segment, WordStore
+from y2a.utils import get_version
+
+# parse ステージの結果に影響する設定
+PARSE_KEYS = (
+    "boundaries",
+    "segmenter",
+    "min_words",
+    "max_duration",
+    "should_keep_dups",
+    "margin_start",
+    "margin_end",
+)
+
+# extract ステージの結果に影響する設定
+EXTRACT_KEYS = (
+    "image_ext",
+    "audio_ext",
+)
+
+
+def file_digest(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def file_stamp(file_path: str) -> str:
+    """
+    大きなファイル（動画）用の軽量な識別子
+    """
+    st = os.stat(file_path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def config_slice(config, keys) -> dict:
+    result = {}
+    for key in keys:
+        value = config.get(key)
+        if isinstance(value, timedelta):
+            value = value // timedelta(milliseconds=1)
+        elif isinstance(value, (tuple, list)):
+            value = sorted(value)
+        result[key] = value
+    return result
+
+
+def fingerprint(*parts) -> str:
+    data = json.dumps([get_version(), *parts], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def dump_segments(segments: list[Segment]) -> list[list[int]]:
+    return [[seg.lo, seg.hi, seg.start_ms, seg.end_ms] for seg in segments]
+
+
+def load_segments(store: WordStore, rows: list[list[int]]) -> list[Segment]:
+    return [
+        Segment(store=store, lo=lo, hi=hi, start=start, end=end)
+        for lo, hi, start, end in rows
+    ]
+
+
+class Manifest:
+    """ステージ毎の入力の指紋と結果を記録するクラス"""
+
+    def __init__(self, file_path: str, stages: dict | None = None) -> None:
+        self.file_path = file_path
+        self.stages = stages or {}
+
+    @classmethod
+    def load(cls, video_id: str) -> "Manifest":
+        file_path = f"{video_id}/{video_id}.manifest.json"
+        stages = None
+        if os.path.exists(file_path):
+            try:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    stages = json.load(f).get("stages")
+            except (OSError, ValueError):
+                stages = None
+        return cls(file_path, stages)
+
+    def get(self, stage: str, fp: str) -> dict | None:
+        """指紋が一致する場合のみ、記録済みの結果を返す"""
+        record = self.stages.get(stage)
+        if record is None or record.get("fingerprint") != fp:
+            return None
+        return record
+
+    def set(self, stage: str, fp: str, **data):
+        self.stages[stage] = {"fingerprint": fp, **data}
+
+    def discard(self, stage: str):
+        self.stages.pop(stage, None)
+
+    def save(self):
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"stages": self.stages}, f)
+        os.replace(tmp_path, self.file_path)
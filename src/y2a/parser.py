@@ -1,152 +1,236 @@
-import sys, html
+import html
+from collections.abc import Iterable, Iterator
 from datetime import timedelta
 from rich import print
-from bs4 import BeautifulSoup
+from typing import TYPE_CHECKING
+from lxml import etree
+import numpy as np
 
-from y2a.entity import TimedWord, Segment
+from y2a import profiler
+from y2a.entity import TimedWord, Segment, WordStore, to_ms
 from y2a.utils import (
     get_spacy_document,
+    iter_spacy_documents,
     print_token_count,
     print_summary
 )
 from y2a.splitter import (
+    collect_boundary_chars,
+    iter_chunk_spans,
+    iter_speech_splits,
+    iter_timestamp_splits,
+    split_at_chars_with_dp,
     split_at_doc_boundaries,
     split_at_speech_boundaries,
-    split_at_timestamp_boundaries
+    split_at_timestamp_boundaries,
+    split_with_dp
 )
 
-def parse_into_timedwords(sub_path: str) -> list[TimedWord]:
-    text = ""
-    with open(sub_path, "r") as f:
-        text = f.read()
-    soup = BeautifulSoup(text, "lxml-xml")
-    
-    words: list[TimedWord] = []
+if TYPE_CHECKING:
+    from spacy.tokens.doc import Doc
+
+def iter_timedwords(sub_path: str) -> Iterator[TimedWord]:
+    """
+    srv2 を先頭から逐次読みし、TimedWord を一語ずつ yield する
+    """
     max_delta = timedelta(seconds=2)
+    prev: TimedWord | None = None
 
-    for element in soup("text"):
+    for _, element in etree.iterparse(sub_path, events=("end",), tag="{*}text"):
         start = timedelta(milliseconds=int(element.get("t")))
-        word_text = html.unescape(element.text).strip()
-        end = start + max_delta
-        
+        word_text = html.unescape("".join(element.itertext())).strip()
+
+        # 読み終えた要素を解放して、メモリ使用量を一定に保つ
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
         if word_text.startswith("["):
             word_text = ""
-        
+
         word_text = word_text.replace(">>", "―")
-        
-        word = TimedWord(start, end, word_text)
-        words.append(word)
 
-    for i, word in enumerate(words):
-        if i == 0:
-            continue
-        if words[i-1].end > word.start:
-            # TimedWordはimmutableなため、新しいインスタンスを作成
-            words[i-1] = TimedWord(words[i-1].start, word.start, words[i-1].word)
-    
-    tokens: list[TimedWord] = []
-    for word in words:
-        if " " in word.word:
-            for t in word.word.split(" "):
-                token = TimedWord(word.start, word.end, t)
-                tokens.append(token)
-        else:
-            tokens.append(word)
-    words = tokens
-    
-    words = [w for w in words if w.word]
-
-    return words
-
-def merge_timedwords_into_segments(timedwords: list[TimedWord], sentences: list[str]) -> list[Segment]:
-    words = [w.word for w in timedwords]
-    segments: list[Segment] = []
+        word = TimedWord(start, start + max_delta, word_text)
+
+        # 一語先読みで、直前の語の end を次の語の start までに詰める
+        if prev is not None:
+            if prev.end > start:
+                prev = TimedWord(prev.start, start, prev.word)
+            yield from _split_timedword(prev)
+        prev = word
+
+    if prev is not None:
+        yield from _split_timedword(prev)
+
+
+def _split_timedword(word: TimedWord) -> Iterator[TimedWord]:
+    if " " not in word.word:
+        if word.word:
+            yield word
+        return
+    for t in word.word.split(" "):
+        if t:
+            yield TimedWord(word.start, word.end, t)
+
+
+def parse_into_timedwords(sub_path: str) -> list[TimedWord]:
+    return list(iter_timedwords(sub_path))
+
+
+def parse_into_word_store(sub_path: str) -> WordStore:
+    with profiler.span("parse_into_word_store"):
+        return WordStore.from_timedwords(iter_timedwords(sub_path))
 
+
+def merge_timedwords_into_segments(store: WordStore, spans: list[tuple[int, int]]) -> list[Segment]:
+    """
+    文字区間 (start_char, end_char) を語の区間に写像する（一回の線形走査）
+    """
+    return list(iter_merged_segments(store, [spans]))
+
+
+def iter_merged_segments(store: WordStore, span_batches: Iterable[list[tuple[int, int]]]) -> Iterator[Segment]:
+    """
+    文字区間のまとまり（チャンク毎）を順に受け取り、語の区間を yield する
+
+    spaCy のトークンが語の途中で区切られた場合は、その語を前のセグメントに含め、
+    次のセグメントの先頭を詰めて同期し直す。
+    """
     pos = 0
-    mismatched = False
-    for sent in sentences:
-        sent_len = len(sent.split(" "))
-        result = " ".join(words[pos:pos+sent_len])
-        if mismatched:
-            print(sent)
-            print(words[pos:pos+sent_len])
-            sys.exit(1)
-
-        if sent != result:
-            print("[red][ERROR][/]", "Text did not match")
-            print(sent)
-            print(words[pos:pos+sent_len])
-            mismatched = True
-
-        seg = Segment(timedwords[pos:pos+sent_len])
-        segments.append(seg)
-        pos += sent_len
-    
-    # for sent in sentences:
-    #     candidate = words[pos]
-    #     if sent in candidate:
-    #         seg = Segment(timedwords[pos:pos+1])
-    #         segments.append(seg)
-    #         pos += 1
-    #         continue
-    #     for i in range(1, words_len - pos):
-    #         candidate += " " + words[pos+i]
-    #         if sent in candidate:
-    #             seg = Segment(timedwords[pos:pos+i+1])
-    #             segments.append(seg)
-    #             pos += i + 1
-    #             break
-    return segments
+    resynced = 0
+    for spans in span_batches:
+        if not spans:
+            continue
+
+        bounds = np.asarray(spans, dtype=np.int64)
+        los = store.word_index(bounds[:, 0]).tolist()
+        his = (store.word_index(bounds[:, 1] - 1) + 1).tolist()
+
+        for lo, hi in zip(los, his):
+            if lo != pos:
+                resynced += 1
+            hi = min(hi, len(store))
+            if hi <= pos:
+                # 語の途中の区切りで、前のセグメントに吸収された
+                continue
+            yield store.view(pos, hi)
+            pos = hi
+
+    if resynced:
+        print("[cyan][INFO][/]", f"Re-synchronized {resynced:,} boundaries inside words.")
+
+
+def apply_margins(segments: list[Segment], config) -> list[Segment]:
+    if not segments:
+        return segments
+
+    margin_start = to_ms(config.get("margin_start"))
+    margin_end   = to_ms(config.get("margin_end"))
+
+    starts = np.fromiter((seg.start_ms for seg in segments), dtype=np.int64, count=len(segments))
+    ends   = np.fromiter((seg.end_ms for seg in segments), dtype=np.int64, count=len(segments))
+
+    # 先頭を前に広げる（0 を下回る場合はそのまま）
+    starts = np.where(margin_start < starts, starts - margin_start, starts)
+    # 末尾を後ろに広げる（最後のセグメントを除く）
+    ends[:-1] += margin_end
+
+    return [
+        seg.with_bounds(int(start), int(end))
+        for seg, start, end in zip(segments, starts, ends)
+    ]
+
+
+def iter_margins(segments: Iterable[Segment], config) -> Iterator[Segment]:
+    """
+    apply_margins の逐次版（最後のセグメントを知るため一つ先読みする）
+    """
+    margin_start = to_ms(config.get("margin_start"))
+    margin_end   = to_ms(config.get("margin_end"))
+
+    def _with_margins(seg: Segment, is_last: bool) -> Segment:
+        start = seg.start_ms
+        if margin_start < start:
+            start -= margin_start
+        end = seg.end_ms if is_last else seg.end_ms + margin_end
+        return seg.with_bounds(start, end)
+
+    prev = None
+    for seg in segments:
+        if prev is not None:
+            yield _with_margins(prev, False)
+        prev = seg
+    if prev is not None:
+        yield _with_margins(prev, True)
 
 
 def parse(subtitle_path: str, config) -> list[Segment]:
-    timedwords = parse_into_timedwords(subtitle_path)
-    text = " ".join(w.word for w in timedwords)
-    doc = get_spacy_document(text, config)
+    store = parse_into_word_store(subtitle_path)
+    doc = get_spacy_document(store.text, config)
+
+    return parse_document(store, doc, config)
 
-    if config.get("is_verbose"):
-        print_token_count(doc)
+
+def split_document(store: WordStore, doc: "Doc", config) -> list[Segment]:
+    """
+    Split an analyzed transcript into segments (before dedupe and margins)
+    """
+    if config.get("segmenter") == "dp":
+        # Choose all cuts at once with a dynamic program
+        with profiler.span("split_with_dp"):
+            return split_with_dp(store, doc, config)
 
     # Split doc at the sentence boundaries and grammatical boundaries
-    sentences: list[str] = split_at_doc_boundaries(doc, config)
+    with profiler.span("split_at_doc_boundaries"):
+        spans: list[tuple[int, int]] = split_at_doc_boundaries(doc, config)
 
-    # (timedwords, sentences) -> segments
-    segments: list[Segment] = merge_timedwords_into_segments(timedwords, sentences)
+    # (timedwords, spans) -> segments
+    with profiler.span("merge_timedwords_into_segments"):
+        segments: list[Segment] = merge_timedwords_into_segments(store, spans)
 
     # Split at the timestamp gap
-    segments = split_at_timestamp_boundaries(segments)
+    with profiler.span("split_at_timestamp_boundaries"):
+        segments = split_at_timestamp_boundaries(segments)
 
     # Split at the speech pause
     if "speech" in config.get("boundaries"):
-        segments = split_at_speech_boundaries(segments, config)
+        with profiler.span("split_at_speech_boundaries"):
+            segments = split_at_speech_boundaries(segments, config)
+
+    return segments
+
+
+def remove_duplicates(segments: list[Segment]) -> list[Segment]:
+    return list(iter_unique(segments))
+
+
+def iter_unique(segments: Iterable[Segment]) -> Iterator[Segment]:
+    unique_sents = set()
+    for seg in segments:
+        if seg.sentence in unique_sents:
+            continue
+        unique_sents.add(seg.sentence)
+        yield seg
+
+
+def parse_document(store: WordStore, doc: "Doc", config) -> list[Segment]:
+    """
+    Split an analyzed transcript into segments
+    """
+    if config.get("is_verbose"):
+        print_token_count(doc)
+
+    segments = split_document(store, doc, config)
 
     # Remove dups
     if not config.get("should_keep_dups"):
         print("[cyan][INFO][/]", "Removing duplicates...")
-        unique_segs = []
-        unique_sents = set()
-        for seg in segments:
-            if seg.sentence in unique_sents:
-                continue
-            unique_segs.append(seg)
-            unique_sents.add(seg.sentence)
-        segments = unique_segs
+        with profiler.span("remove_duplicates"):
+            segments = remove_duplicates(segments)
         print("[cyan][INFO][/]", f"\t-> {len(segments):,} segments.")
 
-    # Add margins (Segmentはimmutableなため、TimedWordsを修正)
-    for i, seg in enumerate(segments):
-        margin_start = config.get("margin_start")
-        margin_end   = config.get("margin_end")
-        
-        # 先頭のTimedWordを修正
-        if margin_start < seg[0].start:
-            first_word = seg[0]
-            seg[0] = TimedWord(first_word.start - margin_start, first_word.end, first_word.word)
-        
-        # 末尾のTimedWordを修正
-        if i < len(segments) - 1:
-            last_word = seg[-1]
-            seg[-1] = TimedWord(last_word.start, last_word.end + margin_end, last_word.word)
+    # Add margins (ビューの start/end を上書きする)
+    segments = apply_margins(segments, config)
 
     if config.get("is_verbose"):
         print_summary(segments, config)
@@ -154,3 +238,39 @@ def parse(subtitle_path: str, config) -> list[Segment]:
     return segments
 
 
+def can_stream(config) -> bool:
+    """
+    Doc 全体が要らない（.spacy の書き出しも語数の集計もしない）場合は逐次処理できる
+    """
+    return "spacy" not in config.get("formats") and not config.get("is_verbose")
+
+
+def iter_parsed_segments(store: WordStore, config) -> Iterator[Segment]:
+    """
+    parse_document の逐次版
+
+    チャンク毎に解析した Doc から境界を求めて手放し、セグメントを
+    分割・重複除去・余白の適用まで一つずつ流す。同時に持つ Doc はチャンク 1 つ分。
+    run では extract がこのイテレータを回し、出来たセグメントから順に切り出す。
+    各パスは交互に進むため、--profile ではパス毎に next() の時間を合計して記録する。
+    """
+    chunks = profiler.timed("iter_spacy_documents", iter_spacy_documents(store.text, config))
+
+    if config.get("segmenter") == "dp":
+        # DP は全体を一度に解くが、必要なのは境界の文字位置だけ
+        with profiler.span("split_at_doc_boundaries", is_exclusive=True):
+            sentence_chars, grammar_chars = collect_boundary_chars(chunks, config)
+        with profiler.span("split_with_dp"):
+            segments: Iterable[Segment] = split_at_chars_with_dp(store, sentence_chars, grammar_chars, config)
+    else:
+        print("[cyan][INFO][/]", "Splitting at the boundaries ...")
+        spans = profiler.timed("split_at_doc_boundaries", iter_chunk_spans(chunks, config))
+        segments = profiler.timed("merge_timedwords_into_segments", iter_merged_segments(store, spans))
+        segments = profiler.timed("split_at_timestamp_boundaries", iter_timestamp_splits(segments))
+        if "speech" in config.get("boundaries"):
+            segments = profiler.timed("split_at_speech_boundaries", iter_speech_splits(segments, config))
+
+    if not config.get("should_keep_dups"):
+        segments = profiler.timed("remove_duplicates", iter_unique(segments))
+
+    yield from iter_margins(segments, config)
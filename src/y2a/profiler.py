@@ -0,0 +1,287 @@
+import os, sys, json, time, threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager, nullcontext
+from rich import print
+from rich.console import Console
+from rich.table import Table
+
+try:
+    import resource
+except ImportError:
+    # Windows には resource がない（peak RSS は記録しない）
+    resource = None
+
+# --profile_hook で選べるプロファイラ
+HOOKS = ("cprofile", "pyinstrument")
+
+_PROFILER: "Profiler | None" = None
+
+
+def get_peak_rss() -> int:
+    """
+    プロセスの peak RSS（バイト）
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Profiler:
+    """区間毎の wall/CPU 時間と peak RSS を Chrome trace event として記録するクラス"""
+
+    def __init__(self, hook: str | None = None, out_dir: str = ".") -> None:
+        self.hook = hook
+        self.out_dir = out_dir
+        self.origin = time.perf_counter()
+        self.events: list[dict] = []
+        self.tracks: dict[str, int] = {}
+        self.lock = threading.Lock()
+        # timed の next() の中で使われた時間（内側の区間の分を差し引くため）
+        self.local = threading.local()
+        # cProfile は同時に一つしか有効にできないため、並行するステージは計測しない
+        self.hook_lock = threading.Lock()
+
+    def _track(self, name: str) -> int:
+        with self.lock:
+            if name not in self.tracks:
+                self.tracks[name] = len(self.tracks) + 1
+            return self.tracks[name]
+
+    def record(self, name: str, cat: str, t0: float, t1: float, track: str | None = None, **args):
+        """
+        perf_counter() で計った [t0, t1] を完了イベント（ph: X）として追加する
+        """
+        if track is None:
+            track = threading.current_thread().name
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": (t0 - self.origin) * 1e6,
+            "dur": (t1 - t0) * 1e6,
+            "pid": os.getpid(),
+            "tid": self._track(track),
+            "args": args,
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def _enter(self) -> tuple[list[float] | None, list[float], float, float]:
+        outer = getattr(self.local, "nested", None)
+        nested = self.local.nested = [0.0, 0.0]
+        return outer, nested, time.perf_counter(), time.thread_time()
+
+    def _exit(self, outer: list[float] | None, t0: float, cpu: float) -> tuple[float, float]:
+        wall = time.perf_counter() - t0
+        cpu = time.thread_time() - cpu
+        self.local.nested = outer
+        # 外側の timed（と is_exclusive の span）からは、この区間の時間を差し引く
+        if outer is not None:
+            outer[0] += wall
+            outer[1] += cpu
+        return wall, cpu
+
+    @contextmanager
+    def span(self, name: str, cat: str = "pass", is_exclusive: bool = False, **args):
+        """
+        is_exclusive なら、内側の span と timed の時間を含めない
+        """
+        outer, nested, t0, cpu = self._enter()
+        try:
+            yield
+        finally:
+            wall, cpu = self._exit(outer, t0, cpu)
+            if is_exclusive:
+                wall -= nested[0]
+                cpu -= nested[1]
+            self.record(
+                name, cat, t0, t0 + wall,
+                cpu_ms=round(cpu * 1000, 3),
+                peak_rss=get_peak_rss(),
+                **args,
+            )
+
+    def timed(self, name: str, items: Iterable, cat: str = "pass", is_exclusive: bool = True, **args) -> Iterator:
+        """
+        items の next() にかかった時間を合計し、反復の終わりに一つの区間として記録する
+
+        逐次処理ではパスの処理が交互に進むため、区間で囲む代わりに使う。
+        is_exclusive なら、内側の span と timed の時間は含めない。
+        """
+        it = iter(items)
+        start = None
+        total = [0.0, 0.0]
+        try:
+            while True:
+                outer, nested, t0, cpu = self._enter()
+                if start is None:
+                    start = t0
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    wall, cpu = self._exit(outer, t0, cpu)
+                    if is_exclusive:
+                        wall -= nested[0]
+                        cpu -= nested[1]
+                    total[0] += wall
+                    total[1] += cpu
+                yield item
+        finally:
+            if start is not None:
+                self.record(
+                    name, cat, start, start + total[0],
+                    cpu_ms=round(total[1] * 1000, 3),
+                    peak_rss=get_peak_rss(),
+                    **args,
+                )
+
+    @contextmanager
+    def hooked(self, name: str):
+        """
+        cProfile / pyinstrument でこのスレッドの区間を計測し、out_dir に保存する
+        """
+        if self.hook is None or not self.hook_lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            with self._hooked(name):
+                yield
+        finally:
+            self.hook_lock.release()
+
+    @contextmanager
+    def _hooked(self, name: str):
+        if self.hook == "cprofile":
+            import cProfile
+
+            prof = cProfile.Profile()
+            prof.enable()
+            try:
+                yield
+            finally:
+                prof.disable()
+                prof.dump_stats(os.path.join(self.out_dir, f"{name}.prof"))
+        elif self.hook == "pyinstrument":
+            from pyinstrument import Profiler as Pyinstrument
+
+            prof = Pyinstrument()
+            prof.start()
+            try:
+                yield
+            finally:
+                prof.stop()
+                with open(os.path.join(self.out_dir, f"{name}.html"), "w", encoding="utf-8") as f:
+                    f.write(prof.output_html())
+
+    def to_trace(self) -> dict:
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+            for name, tid in self.tracks.items()
+        ]
+        return {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+
+
+def enable(hook: str | None = None, out_dir: str = ".") -> Profiler:
+    global _PROFILER
+    if hook == "pyinstrument":
+        from importlib.util import find_spec
+
+        if find_spec("pyinstrument") is None:
+            print("[red][ERROR][/]", "pyinstrument is not installed.")
+            sys.exit(1)
+    _PROFILER = Profiler(hook, out_dir)
+    return _PROFILER
+
+
+def is_enabled() -> bool:
+    return _PROFILER is not None
+
+
+def span(name: str, cat: str = "pass", is_exclusive: bool = False, **args):
+    """
+    --profile のときだけ区間を記録する（無効時は何もしない）
+    """
+    if _PROFILER is None:
+        return nullcontext()
+    return _PROFILER.span(name, cat, is_exclusive, **args)
+
+
+def timed(name: str, items: Iterable, cat: str = "pass", is_exclusive: bool = True, **args) -> Iterable:
+    """
+    --profile のときだけ、items を反復する時間をパスとして記録する
+    """
+    if _PROFILER is None:
+        return items
+    return _PROFILER.timed(name, items, cat, is_exclusive, **args)
+
+
+@contextmanager
+def stage(name: str, config=None):
+    """
+    ステージ全体の区間（--profile_hook があればそのプロファイラも通す）
+    """
+    if _PROFILER is None:
+        yield
+        return
+
+    video_id = config.get("video_id") if config else None
+    label = f"{name}-{video_id}" if video_id else name
+    args = {"video_id": video_id} if video_id else {}
+    with _PROFILER.span(name, "stage", **args), _PROFILER.hooked(label):
+        yield
+
+
+def record_job(name: str, t0: float, t1: float, track: str, **args):
+    if _PROFILER is not None:
+        _PROFILER.record(name, "ffmpeg", t0, t1, track, **args)
+
+
+def write_trace(file_path: str):
+    if _PROFILER is None:
+        return
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(_PROFILER.to_trace(), f)
+    print("[cyan][INFO][/]", f"[green]File created: {file_path}")
+
+
+def print_summary():
+    """
+    区間名毎の合計時間、ffmpeg ジョブの件数と失敗数を表にする
+    """
+    if _PROFILER is None:
+        return
+
+    rows: dict[tuple[str, str], list] = {}
+    for e in _PROFILER.events:
+        key = (e["cat"], e["name"] if e["cat"] != "ffmpeg" else e["args"].get("lane", "ffmpeg"))
+        row = rows.setdefault(key, [0, 0.0, 0.0, 0, 0])
+        row[0] += 1
+        row[1] += e["dur"] / 1000
+        row[2] += e["args"].get("cpu_ms", 0.0)
+        row[3] = max(row[3], e["args"].get("peak_rss", 0))
+        row[4] += e["args"].get("returncode", 0) != 0
+
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Kind")
+    table.add_column("Name")
+    table.add_column("Count", justify="right")
+    table.add_column("Wall (ms)", justify="right")
+    table.add_column("CPU (ms)", justify="right")
+    table.add_column("Peak RSS (MB)", justify="right")
+    table.add_column("Failed", justify="right")
+
+    for (cat, name), (count, wall, cpu, peak, failed) in rows.items():
+        is_job = cat == "ffmpeg"
+        table.add_row(
+            cat, name, f"{count:,}", f"{wall:,.1f}",
+            "" if is_job else f"{cpu:,.1f}",
+            "" if is_job else f"{peak / (1 << 20):,.1f}",
+            f"{failed:,}" if is_job else "",
+        )
+
+    print()
+    Console().print(table)
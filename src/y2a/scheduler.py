@@ -0,0 +1,163 @@
+import time, asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable
+from rich import print
+from y2a import profiler
+
+
+# 失敗したジョブをやり直す回数と、最初の待ち時間（秒、やり直す度に倍にする）
+RETRIES = 2
+BACKOFF = 1.0
+
+
+class Job:
+    """サブプロセスで実行するコマンドと、その見積もりコスト
+
+    finish は終了コードを受け取って出力を確定（または破棄）し、成功したかを返す。
+    split は失敗後に呼ばれ、欠けた出力だけを作り直すジョブのリストを返す
+    （ある場合は同じジョブをやり直す代わりにそれらを実行する）。
+    """
+
+    __slots__ = ("cmd", "cost", "label", "finish", "split")
+
+    def __init__(
+        self,
+        cmd: list[str],
+        cost: float,
+        label: str,
+        finish: Callable[[int], bool] | None = None,
+        split: Callable[[], list["Job"]] | None = None,
+    ) -> None:
+        self.cmd = cmd
+        self.cost = cost
+        self.label = label
+        self.finish = finish
+        self.split = split
+
+    def __repr__(self) -> str:
+        return f"Job({self.label!r}, cost={self.cost})"
+
+
+class Lane:
+    """同時実行数の上限を共有するジョブの列
+
+    入力がまだ揃っていない場合は、jobs の代わりに source（ジョブのリストを
+    返す async 関数）を渡す。入力が少しずつ揃う場合は stream（ジョブを順に
+    yield する async generator 関数）を渡し、揃った分から実行する。
+    """
+
+    __slots__ = ("name", "limit", "jobs", "source", "stream", "retries", "backoff")
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        jobs: list[Job] | None = None,
+        source: Callable[[], Awaitable[list[Job]]] | None = None,
+        stream: Callable[[], AsyncIterator[Job]] | None = None,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+    ) -> None:
+        self.name = name
+        self.limit = max(1, limit)
+        self.jobs = jobs or []
+        self.source = source
+        self.stream = stream
+        self.retries = retries
+        self.backoff = backoff
+
+
+async def run_job(job: Job) -> int:
+    proc = await asyncio.create_subprocess_exec(
+        *job.cmd,
+        stdin=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        return await proc.wait()
+    except asyncio.CancelledError:
+        # キャンセル時は ffmpeg を残さずに終了させる
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+
+
+async def iter_lane_jobs(lane: Lane) -> AsyncIterator[Job]:
+    if lane.stream is not None:
+        # 揃った順に流す（全体が分からないので並べ替えない）
+        async for job in lane.stream():
+            yield job
+        return
+
+    jobs = lane.jobs if lane.source is None else await lane.source()
+
+    # 長いジョブから先に流し、最後に長いジョブだけが残らないようにする
+    for job in sorted(jobs, key=lambda job: -job.cost):
+        yield job
+
+
+async def run_lane(lane: Lane, failed: list[Job], on_done: Callable[[Job], None] | None = None):
+    # キューの長さを同時実行数で抑え、投入側を待たせる（backpressure）
+    queue: asyncio.Queue[Job | None] = asyncio.Queue(maxsize=lane.limit)
+
+    async def attempt(job: Job, index: int, n: int) -> bool:
+        t0 = time.perf_counter()
+        try:
+            returncode = await run_job(job)
+        except OSError as e:
+            print("[red][ERROR][/]", f"{lane.name} job failed to start: {e}")
+            returncode = -1
+        ok = returncode == 0
+        if job.finish is not None:
+            ok = job.finish(returncode) and ok
+        profiler.record_job(
+            job.label, t0, time.perf_counter(), f"ffmpeg-{lane.name}-{index}",
+            lane=lane.name, returncode=returncode, cost=job.cost, attempt=n,
+        )
+        return ok
+
+    async def run(job: Job, index: int, retries: int):
+        ok = await attempt(job, index, 0)
+        if not ok and job.split is not None:
+            # 欠けた出力だけを個別のジョブでやり直す（同じバッチは繰り返さない）。
+            # 個別のジョブもバックオフ付きのやり直しを残りの回数だけ行う
+            for sub in job.split():
+                await run(sub, index, retries)
+            return
+        for n in range(1, retries + 1):
+            if ok:
+                break
+            delay = lane.backoff * 2 ** (n - 1)
+            print("[yellow][WARN][/]", f"Retrying in {delay:g} s ({lane.name}, {n}/{retries}):", job.label)
+            await asyncio.sleep(delay)
+            ok = await attempt(job, index, n)
+        if not ok:
+            print("[red][ERROR][/]", f"Extraction failed ({lane.name}):", job.label)
+            failed.append(job)
+
+    async def worker(index: int):
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            await run(job, index, lane.retries)
+            if on_done:
+                on_done(job)
+
+    async with asyncio.TaskGroup() as tg:
+        for i in range(lane.limit):
+            tg.create_task(worker(i))
+        async for job in iter_lane_jobs(lane):
+            await queue.put(job)
+        for _ in range(lane.limit):
+            await queue.put(None)
+
+
+async def run_lanes(lanes: list[Lane], on_done: Callable[[Job], None] | None = None) -> list[Job]:
+    """
+    レーン毎の上限を守りながら全ジョブを実行し、失敗したジョブを返す
+    """
+    failed: list[Job] = []
+    async with asyncio.TaskGroup() as tg:
+        for lane in lanes:
+            tg.create_task(run_lane(lane, failed, on_done))
+    return failed
@@ -1,66 +1,14 @@
-import re
-from datetime import timedelta
-from spacy.tokens import Token
-from spacy.tokens.doc import Doc
+from collections.abc import Iterable, Iterator
+from typing import TYPE_CHECKING
+import numpy as np
 from rich import print
-from y2a.entity import Segment
+from y2a.entity import Segment, WordStore, to_ms
+from y2a.grammar import DEFAULT_RULES_PATH, get_grammar_rules, get_rules_path
 
-# 副詞節を導く従属接続詞（分割対象）
-SUBORDINATORS = {
-    "because", "cuz", "coz", "although",
-    "if", "unless",
-    "when", "while", "before", "after", "since", "until", "till",
-}
+if TYPE_CHECKING:
+    from spacy.tokens.doc import Doc
 
-def is_nominal_clause_marker(token: Token):
-    norm = token.text.lower()
-    if norm not in {"that", "if", "whether"}:
-        return False
-
-    # 従属接続詞でない場合は除外（関係副詞などを区別）
-    if token.dep_ != "mark":
-        return False
-
-    head = token.head
-
-    # 名詞節の条件：節が動詞の補語になっている
-    if head.dep_ in {"ccomp", "xcomp", "obj"}:
-        return True
-
-    # 動詞に直接ぶら下がり、副詞節ではなく補語の場合
-    if head.pos_ == "VERB" and head.dep_ not in {"advcl"}:
-        return True
-
-    return False
-
-
-def is_clause_level_cc(token: Token):
-    """等位接続詞（and, but, or）が節レベルかどうか判定"""
-    if token.dep_ != "cc":
-        return False
-    
-    # 判定方法: 等位接続詞の直後が節（動詞を含む）かどうかで判定する
-    # 例: "I went home and I slept." -> and の後に I(動詞主語が続く) -> 節レベル
-    # 例: "cats and dogs" -> and の後に dogs(名詞) -> 句レベル
-    try:
-        head = token.head
-
-        if head.pos_ == "VERB" and head.dep_ == "ROOT":
-            return True
-
-        # head の conjunct を探す（head の依存構造で conj でマークされた要素）
-        for child in head.children:
-            if child.dep_ == "conj":
-                # conj の要素が動詞なら、この and は節レベル
-                if child.pos_ == "VERB":
-                    return True
-    except Exception:
-        pass
-
-    return False  # 句レベル（cats and dogs 等）
-
-
-def get_sentence_boundaries(doc: Doc) -> set:
+def get_sentence_boundaries(doc: "Doc") -> set:
     split_points = set()
     
     # 通常のsentence boundary
@@ -87,56 +35,17 @@ def get_sentence_boundaries(doc: Doc) -> set:
     return split_points
 
 
-def get_grammatical_boundaries(doc: Doc) -> set:
-    split_points = set()
-    
-    for i, t in enumerate(doc):
-        candidate = False
-
-        if is_nominal_clause_marker(t): # 名詞節（補文）
-            candidate = False
-        elif t.dep_ == "mark": # 副詞節導入語 ( because 等)
-            lower = t.text.lower()
-            lower = re.sub(r'[^a-zA-Z]', '', lower)
-            # if lower in SUBORDINATORS:
-            if lower not in {"as", "that", "though"}:
-                # 通常は mark の直前で分割（ただし同一文内に限る）
-                try:
-                    sent = t.sent
-                    if t.i > sent.start:
-                        split_idx = t.i - 1
-                        candidate = True
-                    else:
-                        # mark が文頭にある場合: "If I go there, I can..."
-                        # 同一文内のカンマを探してその位置で分割する
-                        comma_idx = None
-                        for tok in sent:
-                            if tok.text == ",":
-                                comma_idx = tok.i
-                                break
-                        if comma_idx is not None:
-                            split_idx = comma_idx
-                            candidate = True
-                        else:
-                            candidate = False
-                except Exception:
-                    candidate = False
-        # 等位接続詞（節レベル）
-        elif t.dep_ == "cc" and is_clause_level_cc(t):
-            split_idx = i - 1 if i - 1 >= 0 else i
-            candidate = True
-        # カンマ
-        elif t.text == ",":
-            split_idx = i
-            candidate = True
-
-        if candidate:
-            split_points.add(split_idx)
-
-    return split_points
+def get_grammatical_boundaries(doc: "Doc", rules_path: str = DEFAULT_RULES_PATH) -> set:
+    """
+    ルールファイル（既定は rules/grammar.json）に基づく文法的な分割位置
+    """
+    return get_grammar_rules(doc.vocab, rules_path).find_boundaries(doc)
 
 
-def split_at_doc_boundaries(doc: Doc, config) -> list[str]:
+def split_at_doc_boundaries(doc: "Doc", config) -> list[tuple[int, int]]:
+    """
+    doc を分割し、各セグメントの doc.text 上の文字区間 (start_char, end_char) を返す
+    """
     min_words = config.get("min_words")
     
     if "sentence" in config.get("boundaries"):
@@ -148,122 +57,366 @@ def split_at_doc_boundaries(doc: Doc, config) -> list[str]:
         
     if "grammar" in config.get("boundaries"):
         print("[cyan][INFO][/]", "Splitting at the grammatical boundaries ...")
-        grammatical_boundaries = get_grammatical_boundaries(doc)
+        grammatical_boundaries = get_grammatical_boundaries(doc, get_rules_path(config))
     else:
         grammatical_boundaries = set()
     
+    segments = get_doc_spans(doc, sentence_boundaries, grammatical_boundaries, min_words)
+
+    if "grammar" in config.get("boundaries"):
+        print("[cyan][INFO][/]", f"\t-> {len(segments) + 1:,} segments.")
+
+    return segments
+
+
+def get_doc_spans(doc: "Doc", sentence_boundaries: set, grammatical_boundaries: set, min_words: int) -> list[tuple[int, int]]:
+    """
+    分割位置（トークン位置）から各セグメントの文字区間を求める
+    """
     split_points = sorted(sentence_boundaries | grammatical_boundaries)
 
+    # トークンの区間 [first, last] を文字区間に変換する
+    def _span(first: int, last: int) -> tuple[int, int]:
+        return doc[first].idx, doc[last].idx + len(doc[last])
+
     segments = []
     last = 0
 
     for i, idx in enumerate(split_points):
-        seg_tokens = doc[last:idx+1]
+        seg_len = idx + 1 - last
         
         if i + 1 < len(split_points):
-            next_tokens = doc[idx+1:split_points[i+1]+1]
+            next_len = split_points[i+1] - idx
         else:
-            next_tokens = doc[idx+1:]
+            next_len = len(doc) - idx - 1
 
         is_sentence_boundary = idx in sentence_boundaries
         
         if is_sentence_boundary:
             # 文末境界: 最小語数チェックなしで分割
-            segments.append(seg_tokens.text)
+            segments.append(_span(last, idx))
             last = idx + 1
         else:
             # 文法的分割: 現在のセグメントと次のセグメント両方の最小語数をチェック
-            if len(seg_tokens) >= min_words and len(next_tokens) >= min_words:
-                segments.append(seg_tokens.text)
+            if seg_len >= min_words and next_len >= min_words:
+                segments.append(_span(last, idx))
                 last = idx + 1
     
     # 最後の部分を追加
     if last < len(doc):
-        segments.append(doc[last:].text)
-    
-    if "grammar" in config.get("boundaries"):
-        print("[cyan][INFO][/]", f"\t-> {len(segments) + 1:,} segments.")
+        segments.append(_span(last, len(doc) - 1))
 
     return segments
 
 
-def split_at_speech_boundaries(segments: list[Segment], config) -> list[Segment]:
-    print("[cyan][INFO][/]", "Splitting at the speech boundareis ...")
+def get_doc_boundaries(doc: "Doc", config) -> tuple[set, set]:
+    """
+    (文末の分割位置, 文法的な分割位置)（境界の種類が無効なら空集合）
+    """
+    boundaries = config.get("boundaries")
+    sentence_boundaries = get_sentence_boundaries(doc) if "sentence" in boundaries else set()
+    if "grammar" in boundaries:
+        grammatical_boundaries = get_grammatical_boundaries(doc, get_rules_path(config))
+    else:
+        grammatical_boundaries = set()
+    return sentence_boundaries, grammatical_boundaries
 
+
+def iter_chunk_spans(chunks: Iterable[tuple[int, "Doc", bool]], config) -> Iterator[list[tuple[int, int]]]:
+    """
+    (文字オフセット, Doc, 文末で終わるか) を順に受け取り、チャンク毎の文字区間（全体の位置）を yield する
+
+    各 Doc は区間を求めた時点で手放す。語の間で切られたチャンクの最後の区間は
+    次のチャンクの最初の区間とつなぐ（チャンクの境界を文末にしない）。
+    """
     min_words = config.get("min_words")
-    max_duration= config.get("max_duration")
+    pending = None
+    for offset, doc, is_end in chunks:
+        spans = [
+            (start + offset, end + offset)
+            for start, end in get_doc_spans(doc, *get_doc_boundaries(doc, config), min_words)
+        ]
+        del doc
+        if pending is not None:
+            spans[:1] = [(pending[0], spans[0][1] if spans else pending[1])]
+            pending = None
+        if not is_end and spans:
+            pending = spans.pop()
+        yield spans
+    if pending is not None:
+        yield [pending]
+
+
+class RangeArgMax:
+    """疎テーブルによる区間最大値の位置クエリ（O(n log n) 構築、O(1) 参照）
+
+    同じ値が複数ある場合は最も左の位置を返す。
+    """
+
+    def __init__(self, values: np.ndarray) -> None:
+        self.values = values
+        n = len(values)
+        dtype = np.int32 if n < (1 << 31) else np.int64
+        self.table = [np.arange(n, dtype=dtype)]
+        width = 2
+        while width <= n:
+            prev = self.table[-1]
+            left = prev[:n - width + 1]
+            right = prev[width // 2:width // 2 + len(left)]
+            self.table.append(np.where(values[left] >= values[right], left, right))
+            width *= 2
+
+    def argmax(self, lo: int, hi: int) -> int:
+        """values[lo:hi] の最大値の位置"""
+        level = (hi - lo).bit_length() - 1
+        a = int(self.table[level][lo])
+        b = int(self.table[level][hi - (1 << level)])
+        return a if self.values[a] >= self.values[b] else b
 
-    def _split(segment: Segment) -> list[Segment]:
-        """
-        単語の時間が最も長い箇所で分割する
-        """
 
-        if len(segment) < min_words:
-            return [segment]
+def split_at_speech_boundaries(segments: list[Segment], config) -> list[Segment]:
+    print("[cyan][INFO][/]", "Splitting at the speech boundareis ...")
 
-        seg_start = segment.start
-        seg_end   = segment.end
-        seg_delta = seg_end - seg_start
+    results = list(iter_speech_splits(segments, config))
+
+    print("[cyan][INFO][/]", f"\t-> {len(results):,} segments.")
 
-        if seg_delta < max_duration:
-            return [segment]
+    return results
 
-        prev_start = segment[0].start
-        max_delta = timedelta(seconds=0)
-        cutting_point = 0
 
-        for i, word in enumerate(segment):
-            cur_delta = word.start - prev_start
-            prev_start = word.start
-            if max_delta < cur_delta:
-                if min(len(segment) - i, i) >= min_words:
-                    max_delta = cur_delta
-                    cutting_point = i
+def iter_speech_splits(segments: Iterable[Segment], config) -> Iterator[Segment]:
+    """
+    max_duration を超えるセグメントを、単語の間隔が最も長い箇所で再帰的に分割する
+    """
+    min_words = config.get("min_words")
+    max_duration = to_ms(config.get("max_duration"))
+    first = max(min_words, 1)
 
-        if cutting_point == 0 or cutting_point == len(segment):
-            return [segment]
+    def _split(segment: Segment) -> Iterator[Segment]:
+        """
+        単語の時間が最も長い箇所で分割する（区間 [lo, hi) を反復的に処理）
+        """
+        length = len(segment)
+        if length < min_words:
+            yield segment
+            return
+
+        starts = segment.store.starts[segment.lo:segment.hi]
+        ends = segment.store.ends[segment.lo:segment.hi]
+        # gaps[k]: 語 k+1 の直前の間隔
+        gaps = np.diff(starts)
+        range_max = None
+
+        stack = [(0, length)]
+        while stack:
+            lo, hi = stack.pop()
+
+            if hi - lo < min_words:
+                yield segment[lo:hi]
+                continue
 
-        # 目的の長さになるまで再帰実行
-        left  = _split(Segment(segment[:cutting_point]))
-        right = _split(Segment(segment[cutting_point:]))
+            seg_start = segment.start_ms if lo == 0 else int(starts[lo])
+            seg_end = segment.end_ms if hi == length else int(ends[hi - 1])
+            if seg_end - seg_start < max_duration:
+                yield segment[lo:hi]
+                continue
 
-        return left + right
+            # 両側に min_words 語以上残る分割位置 i の範囲: [lo + first, min(hi - min_words, hi - 1)]
+            k_lo = lo + first - 1
+            k_hi = min(hi - min_words, hi - 1)
+            cutting_point = 0
+            if k_lo < k_hi:
+                if range_max is None:
+                    range_max = RangeArgMax(gaps)
+                k = range_max.argmax(k_lo, k_hi)
+                if gaps[k] > 0:
+                    cutting_point = k + 1
+
+            if cutting_point == 0:
+                yield segment[lo:hi]
+                continue
+
+            # 左側から先に処理する
+            stack.append((cutting_point, hi))
+            stack.append((lo, cutting_point))
 
-    results: list[Segment] = []
     for seg in segments:
-        results += _split(seg)
+        yield from _split(seg)
     
+
+def split_at_timestamp_boundaries(segments: list[Segment]) -> list[Segment]:
+    print("[cyan][INFO][/]", "Splitting at the timestamp gaps...")
+
+    results = list(iter_timestamp_splits(segments))
+
     print("[cyan][INFO][/]", f"\t-> {len(results):,} segments.")
 
     return results
-    
 
-def split_at_timestamp_boundaries(segments: list[Segment]) -> list[Segment]:
-    print("[cyan][INFO][/]", "Splitting at the timestamp gaps...")
 
-    def _split(segment: Segment) -> list[Segment]:
-        new_segments = []
-        current_seg = []
-        length = len(segment)
+def iter_timestamp_splits(segments: Iterable[Segment]) -> Iterator[Segment]:
+    min_gap_ms = 1000
+    # WordStore ごとに 1 秒以上の空白がある位置を一括で求めておく
+    breaks_by_store = {}
 
-        for i, word in enumerate(segment):
-            current_seg.append(word)
-            if i + 1 >= length:
+    for seg in segments:
+        if not len(seg):
+            continue
+        store = seg.store
+        breaks = breaks_by_store.get(id(store))
+        if breaks is None:
+            breaks = breaks_by_store[id(store)] = store.gap_breaks(min_gap_ms)
+
+        # seg.lo < b < seg.hi となる分割位置
+        first, last = np.searchsorted(breaks, [seg.lo + 1, seg.hi])
+        cuts = [0, *(breaks[first:last] - seg.lo).tolist(), len(seg)]
+        for a, b in zip(cuts, cuts[1:]):
+            yield seg[a:b]
+
+
+# --segmenter dp のコスト（単位はセグメント 1 つ分）
+DP_SEGMENT_COST = 1.0     # セグメントの固定コスト（細切れを防ぐ）
+DP_GRAMMAR_REWARD = 0.5   # 文法的境界で切る報酬
+DP_PAUSE_REWARD = 0.5     # 語の間隔が 1 秒以上の位置で切る報酬（間隔に比例）
+DP_SHORT_PENALTY = 100.0  # min_words 未満のセグメント
+DP_LONG_PENALTY = 10.0    # max_duration の超過分（max_duration に対する割合）あたり
+DP_WINDOW = 2.0           # 探索するセグメントの最長（max_duration の倍数）
+
+
+def get_boundary_chars(doc: "Doc", token_indices: set) -> np.ndarray:
+    """
+    トークン位置（その直後で分割）-> そのトークンの doc.text 上の終端
+    """
+    from spacy.attrs import IDX, LENGTH
+
+    if not token_indices:
+        return np.empty(0, dtype=np.int64)
+
+    indices = np.fromiter(token_indices, dtype=np.int64, count=len(token_indices))
+    return doc.to_array([IDX, LENGTH])[indices].sum(axis=1).astype(np.int64)
+
+
+def get_cut_positions(store: WordStore, chars: np.ndarray) -> np.ndarray:
+    """
+    トークンの終端（文字位置）-> 語の位置（その直前で分割）
+
+    語の途中で区切られた場合は、その語の直後で分割する
+    """
+    if not len(chars):
+        return np.empty(0, dtype=np.int64)
+    return np.unique(store.word_index(chars - 1) + 1)
+
+
+def split_with_dp(store: WordStore, doc: "Doc", config) -> list[Segment]:
+    """
+    doc 全体の境界を候補として split_at_chars_with_dp で分割する
+    """
+    sentence_boundaries, grammatical_boundaries = get_doc_boundaries(doc, config)
+    return split_at_chars_with_dp(
+        store,
+        get_boundary_chars(doc, sentence_boundaries),
+        get_boundary_chars(doc, grammatical_boundaries),
+        config,
+    )
+
+
+def collect_boundary_chars(chunks: Iterable[tuple[int, "Doc", bool]], config) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (文字オフセット, Doc, 文末で終わるか) を順に受け取り、(文末, 文法的境界) の文字位置（全体の位置）を集める
+
+    文境界で切られたチャンクの終端だけを文末として扱う。各 Doc は境界を求めた時点で手放す。
+    """
+    sentence_parts = [np.empty(0, dtype=np.int64)]
+    grammar_parts = [np.empty(0, dtype=np.int64)]
+    for offset, doc, is_end in chunks:
+        sentence_boundaries, grammatical_boundaries = get_doc_boundaries(doc, config)
+        sentence_parts.append(get_boundary_chars(doc, sentence_boundaries) + offset)
+        if is_end:
+            sentence_parts.append(np.array([offset + len(doc.text)], dtype=np.int64))
+        grammar_parts.append(get_boundary_chars(doc, grammatical_boundaries) + offset)
+        del doc
+    return np.concatenate(sentence_parts), np.concatenate(grammar_parts)
+
+
+def split_at_chars_with_dp(store: WordStore, sentence_chars: np.ndarray, grammar_chars: np.ndarray, config) -> list[Segment]:
+    """
+    全ての境界を候補とし、コストが最小になる分割を動的計画法で求める
+
+    文末と 1 秒以上の空白では必ず分割し、その間を O(n·k) で解く
+    （k は DP_WINDOW に収まる語数）。境界は store.text 上の文字位置で受け取る。
+    """
+    print("[cyan][INFO][/]", "Splitting with dynamic programming ...")
+
+    boundaries = config.get("boundaries")
+    min_words = config.get("min_words")
+    max_ms = max(to_ms(config.get("max_duration")), 1)
+    window_ms = max_ms * DP_WINDOW
+    n = len(store)
+
+    # 必ず分割する位置
+    hard_cuts = [np.array([0, n]), store.gap_breaks(1000)]
+    if "sentence" in boundaries:
+        hard_cuts.append(get_cut_positions(store, sentence_chars))
+    cuts = np.unique(np.concatenate(hard_cuts)).tolist()
+
+    # 任意の分割位置と、そこで切る報酬
+    allowed = np.zeros(n + 1, dtype=bool)
+    reward = np.zeros(n + 1)
+    if "grammar" in boundaries:
+        positions = get_cut_positions(store, grammar_chars)
+        allowed[positions] = True
+        reward[positions] += DP_GRAMMAR_REWARD
+    if "speech" in boundaries and n > 1:
+        allowed[1:n] = True
+        reward[1:n] += DP_PAUSE_REWARD * np.minimum(np.diff(store.starts) / 1000, 1.0)
+
+    starts = store.starts.tolist()
+    ends = store.ends.tolist()
+    allowed = allowed.tolist()
+    reward = reward.tolist()
+
+    def _solve(lo: int, hi: int) -> list[int]:
+        """[lo, hi) の分割位置（lo と hi を含む）"""
+        inf = float("inf")
+        cost = {lo: 0.0}
+        prev = {}
+        for j in range(lo + 1, hi + 1):
+            if j < hi and not allowed[j]:
                 continue
-            next_word = segment[i + 1]
-            if next_word.start - word.end >= timedelta(seconds=1):
-                new_segments.append(Segment(current_seg))
-                current_seg = []
-        if current_seg:
-            new_segments.append(Segment(current_seg))
-
-        return new_segments
+            end = ends[j - 1]
+            best, best_i = inf, -1
+            for i in range(j - 1, lo - 1, -1):
+                if i > lo and not allowed[i]:
+                    continue
+                duration = end - starts[i]
+                if duration > window_ms and best < inf:
+                    break
+                c = cost.get(i, inf)
+                if c == inf:
+                    continue
+                c += DP_SEGMENT_COST + (duration / max_ms) ** 2
+                if duration > max_ms:
+                    c += DP_LONG_PENALTY * (duration - max_ms) / max_ms
+                if j - i < min_words and not (i == lo and j == hi):
+                    c += DP_SHORT_PENALTY
+                if i > lo:
+                    c -= reward[i]
+                if c < best:
+                    best, best_i = c, i
+            if best_i >= 0:
+                cost[j] = best
+                prev[j] = best_i
+
+        positions = [hi]
+        while positions[-1] != lo:
+            positions.append(prev[positions[-1]])
+        return positions[::-1]
 
     results = []
-    for seg in segments:
-        results += _split(seg)
+    for lo, hi in zip(cuts, cuts[1:]):
+        positions = _solve(lo, hi)
+        results += [store.view(a, b) for a, b in zip(positions, positions[1:])]
 
     print("[cyan][INFO][/]", f"\t-> {len(results):,} segments.")
 
     return results
-
@@ -0,0 +1,146 @@
+import io, os, json, itertools, statistics
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import TYPE_CHECKING
+
+from rich import print
+from rich.console import Console
+from rich.table import Table
+
+from y2a.parser import remove_duplicates, split_document
+from y2a.utils import get_duration_histogram, get_pipeline_key
+
+if TYPE_CHECKING:
+    from spacy.tokens.doc import Doc
+    from y2a.entity import WordStore
+
+# ワーカープロセス毎に一度だけ受け取る解析結果
+_STORE: "WordStore | None" = None
+_DOC: "Doc | None" = None
+
+
+def expand_grid(config, max_durations, min_words, boundaries, segmenters) -> list[dict]:
+    """
+    各設定の直積を、config を上書きした設定のリストにする
+    """
+    configs = []
+    for d, w, b, s in itertools.product(max_durations, min_words, boundaries, segmenters):
+        configs.append({
+            **config,
+            "max_duration": timedelta(milliseconds=d),
+            "min_words": w,
+            "boundaries": b,
+            "segmenter": s,
+        })
+    return configs
+
+
+def group_by_pipeline(configs: list[dict]) -> list[list[int]]:
+    """
+    load_pipeline が選ぶパイプライン毎に、設定の番号をまとめる
+
+    実際の実行と同じ Doc で評価するため（例: -b sentence は文法的境界を含む設定と
+    同じ Doc ではなく、sentencizer の Doc で評価する）、パイプライン毎に一度ずつ解析する。
+    """
+    groups: dict[tuple[str, tuple[str, ...]], list[int]] = {}
+    for i, config in enumerate(configs):
+        groups.setdefault(get_pipeline_key(config), []).append(i)
+    return list(groups.values())
+
+
+def evaluate(store: "WordStore", doc: "Doc", config) -> dict:
+    """
+    一つの設定で分割し、セグメント数・長さの分布・重複率を集計する
+    """
+    # splitter の進捗表示は組み合わせ毎には不要
+    with redirect_stdout(io.StringIO()):
+        segments = split_document(store, doc, config)
+    unique = remove_duplicates(segments)
+
+    max_ms = config.get("max_duration") // timedelta(milliseconds=1)
+    max_seconds = max_ms // 1000
+    histogram, over_bins = get_duration_histogram(unique, max_seconds)
+    durations = [seg.end_ms - seg.start_ms for seg in unique]
+
+    return {
+        "max_duration": max_ms,
+        "min_words": config.get("min_words"),
+        "boundaries": list(config.get("boundaries")),
+        "segmenter": config.get("segmenter"),
+        "segments": len(segments),
+        "unique": len(unique),
+        "dup_rate": 1 - len(unique) / len(segments) if segments else 0.0,
+        "over_max": sum(d > max_ms for d in durations),
+        "mean_ms": round(statistics.fmean(durations)) if durations else 0,
+        "median_ms": round(statistics.median(durations)) if durations else 0,
+        "histogram": histogram + [over_bins],
+    }
+
+
+def _init_worker(store: "WordStore", doc: "Doc"):
+    global _STORE, _DOC
+    _STORE, _DOC = store, doc
+
+
+def _evaluate_in_worker(config) -> dict:
+    return evaluate(_STORE, _DOC, config)
+
+
+def run_sweep(store: "WordStore", doc: "Doc", configs: list[dict], jobs: int = 0) -> list[dict]:
+    """
+    解析済みの store/doc を各プロセスに一度だけ渡し、全ての設定を並列に評価する
+    """
+    jobs = jobs or max(1, os.cpu_count() // 2)
+    jobs = min(jobs, len(configs))
+    if jobs <= 1:
+        return [evaluate(store, doc, config) for config in configs]
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(store, doc)) as pool:
+        return list(pool.map(_evaluate_in_worker, configs))
+
+
+def run_groups(store: "WordStore", docs: list["Doc"], groups: list[list[int]], configs: list[dict], jobs: int = 0) -> list[dict]:
+    """
+    グループ毎にそのパイプラインの Doc で評価し、configs の順に並べて返す
+    """
+    results = [{} for _ in configs]
+    for doc, group in zip(docs, groups):
+        for i, result in zip(group, run_sweep(store, doc, [configs[i] for i in group], jobs)):
+            results[i] = result
+    return results
+
+
+def print_results(results: list[dict]):
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("max ms", justify="right")
+    table.add_column("min w", justify="right")
+    table.add_column("boundaries")
+    table.add_column("segmenter")
+    table.add_column("segments", justify="right")
+    table.add_column("dups", justify="right")
+    table.add_column("over max", justify="right")
+    table.add_column("median (s)", justify="right")
+    table.add_column("~1s ~2s ... over")
+
+    for r in results:
+        table.add_row(
+            f"{r['max_duration']:,}",
+            str(r["min_words"]),
+            ",".join(r["boundaries"]),
+            r["segmenter"],
+            f"{r['unique']:,}",
+            f"{r['dup_rate']:.1%}",
+            f"{r['over_max']:,}",
+            f"{r['median_ms'] / 1000:.1f}",
+            " ".join(str(n) for n in r["histogram"]),
+        )
+
+    Console().print(table)
+
+
+def write_results(file_path: str, results: list[dict]):
+    with open(file_path, mode="w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=4)
+
+    print("[cyan][INFO][/]", f"[green]File created: {file_path}")
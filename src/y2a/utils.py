@@ -1,15 +1,21 @@
-import os, re, csv, json, collections
+import os, re, csv, json, collections, itertools
+from collections.abc import Iterable
 from datetime import timedelta
 from importlib import import_module
 from importlib.metadata import version, PackageNotFoundError
 
+from typing import TYPE_CHECKING
+
 from rich import print
 from rich.progress import Progress
-import spacy
-from spacy.tokens import DocBin
-from spacy.tokens.doc import Doc
 
-from y2a.entity import Segment
+from y2a import cache, profiler
+
+if TYPE_CHECKING:
+    # spaCy の import は重いため、実際に解析するときまで遅らせる
+    import spacy
+    from spacy.tokens.doc import Doc
+    from y2a.entity import Segment
 
 
 def get_version():
@@ -18,42 +24,378 @@ def get_version():
     except PackageNotFoundError:
         return "0.0.0"
 
-def load_spacy(model_name: str, **kwargs) -> spacy.Language:
+MODEL_NAME = "en_core_web_sm"
+# 文境界だけが必要な場合に使う、モデル不要のパイプライン名
+SENTENCIZER = "sentencizer"
+
+_SPACY_MODELS: dict[tuple[str, tuple[str, ...]], "spacy.Language"] = {}
+
+def load_spacy(model_name: str, exclude: tuple[str, ...] = ()) -> "spacy.Language":
+    # 同一プロセス内では、同じ構成の読み込み済みパイプラインを使い回す
+    key = (model_name, tuple(exclude))
+    if key in _SPACY_MODELS:
+        return _SPACY_MODELS[key]
+
+    import spacy
+
     try:
         model_module = import_module(model_name)
     except ModuleNotFoundError:
         spacy.cli.download(model_name)
         model_module = import_module(model_name)
 
-    return model_module.load(**kwargs)
+    nlp = model_module.load(exclude=list(exclude))
+    # 構文解析を除いた場合は、文境界を句読点で補う
+    if "parser" in exclude:
+        nlp.add_pipe("sentencizer")
+    _SPACY_MODELS[key] = nlp
 
+    return nlp
 
-def get_spacy_document(text: str, config) -> Doc:
-    video_id = config.get("video_id")
-    file_path = f"{video_id}/{video_id}.spacy"
-    nlp = load_spacy("en_core_web_sm")
 
-    print("[cyan][INFO][/]", "Analyzing text...")
-    if os.path.exists(file_path):
-        print("[cyan][INFO][/]", "Skipped. Spacy document found.")
-        loaded_bin = DocBin().from_disk(file_path)
-        doc = list(loaded_bin.get_docs(nlp.vocab))[0]
-        return doc
+def uses_parser(config) -> bool:
+    """
+    文法的境界と .spacy の書き出しには、依存構造解析を含むモデルが必要
+    """
+    return "grammar" in config.get("boundaries") or "spacy" in config.get("formats")
 
-    doc = None
-    with Progress() as p:
-        p.add_task("", total=None)
-        doc = nlp(text)
 
+def get_excluded_components(config) -> tuple[str, ...]:
+    """
+    境界の種類と出力に不要なコンポーネント
+
+    splitter は dep_/pos_/head/sent しか見ないため NER は常に不要、
+    lemma_ は --verbose の print_token_count だけが使う。
+    """
+    # 書き出す Doc は全コンポーネントで解析する
     if "spacy" in config.get("formats"):
-        docbin = DocBin()
-        docbin.add(doc)
-        docbin.to_disk(file_path)
-        print("[cyan][INFO][/]", f"[green]File created: {file_path}")
+        return ()
+
+    exclude = ["ner"]
+    if not uses_parser(config):
+        exclude.append("parser")
+    if not config.get("is_verbose"):
+        exclude.append("lemmatizer")
+    return tuple(exclude)
+
+
+def load_sentencizer() -> "spacy.Language":
+    """
+    句読点だけで文境界を決める軽量パイプライン（モデルの読み込みなし）
+    """
+    key = (SENTENCIZER, ())
+    if key in _SPACY_MODELS:
+        return _SPACY_MODELS[key]
+
+    import spacy
+
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    _SPACY_MODELS[key] = nlp
+
+    return nlp
+
+
+def get_pipeline_key(config) -> tuple[str, tuple[str, ...]]:
+    """
+    load_pipeline が選ぶパイプライン（_SPACY_MODELS のキー）
+
+    構文解析も見出し語も不要な場合はモデル自体を読み込まない。
+    """
+    exclude = get_excluded_components(config)
+    if "parser" in exclude and "lemmatizer" in exclude:
+        return SENTENCIZER, ()
+    return MODEL_NAME, exclude
+
+
+def get_package_version(name: str) -> str:
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return ""
+
+
+def get_pipeline_name(config) -> str:
+    """
+    load_pipeline が選ぶパイプラインの名前・バージョンと、除くコンポーネント
+
+    spaCy もモデルも読み込まずに、インストール済みのバージョンから決める。
+    同じモデルでも除くコンポーネントが違えば別の名前になる（例: --verbose の lemmatizer）。
+    """
+    model_name, exclude = get_pipeline_key(config)
+    name = f"spacy-{get_package_version('spacy')}:{model_name}"
+    if model_name != SENTENCIZER:
+        name += f"-{get_package_version(model_name)}"
+    return f"{name}:-{','.join(exclude)}"
+
+
+def load_pipeline(config) -> "spacy.Language":
+    """
+    config に必要な最小構成のパイプラインを返す
+    """
+    model_name, exclude = get_pipeline_key(config)
+    if model_name == SENTENCIZER:
+        return load_sentencizer()
+    return load_spacy(model_name, exclude)
+
+
+def write_in_spacy(file_path: str, doc: "Doc"):
+    """
+    spacy output
+    """
+    from spacy.tokens import DocBin
+
+    docbin = DocBin()
+    docbin.add(doc)
+    docbin.to_disk(file_path)
+    print("[cyan][INFO][/]", f"[green]File created: {file_path}")
+
+
+def export_spacy_document(doc: "Doc", config):
+    if not "spacy" in config.get("formats"):
+        return
+
+    video_id = config.get("video_id")
+    write_in_spacy(f"{video_id}/{video_id}.spacy", doc)
+
+
+# 長い文字起こしを分割して並列に解析する際の、1チャンクの目安（文字数）
+CHUNK_CHARS = 50_000
+# 分割位置を選ぶために解析する窓の幅（文字数）
+CHUNK_WINDOW_CHARS = 2_000
+# 文境界を探す範囲（CHUNK_CHARS の倍数）。見つからなければ語の間で切る
+MAX_CHUNK_FACTOR = 4
+
+
+def find_sentence_start(text: str, nlp: "spacy.Language", lo: int, hi: int, pos: int, quotes: int = 0) -> int | None:
+    """
+    text[lo:hi] を解析し、spaCy が文頭とした位置のうち pos に最も近いものを返す
+
+    窓の先頭の文（窓の端で切れている）と、引用符の内側・語の途中の位置は使わない。
+    quotes は text[:lo] にある引用符の数（先頭から数え直さないよう、呼び出し側が引き継ぐ）。
+    """
+    doc = nlp(text[lo:hi])
+    starts = []
+    prev = lo
+    for sent in list(doc.sents)[1:]:
+        start = lo + sent.start_char
+        quotes += text.count('"', prev, start)
+        prev = start
+        if text[start - 1] == " " and quotes % 2 == 0:
+            starts.append(start)
+    if not starts:
+        return None
+    return min(starts, key=lambda start: abs(start - pos))
+
+
+def split_text_into_chunks(
+    text: str,
+    nlp: "spacy.Language",
+    target: int | None = None,
+) -> list[tuple[str, bool]]:
+    """
+    target 文字を超えた付近の、spaCy が実際に文頭とした位置で分割し、
+    (チャンク, 文末で終わるか) のリストを返す（チャンク同士はスペース1つで区切られている前提）
+
+    分割位置は、その付近の小さな窓（CHUNK_WINDOW_CHARS）だけを解析して選ぶ。
+    target の MAX_CHUNK_FACTOR 倍まで文境界がなければ語の間で切り、文末としては扱わない。
+    """
+    target = target or CHUNK_CHARS
+    if len(text) <= target:
+        return [(text, True)]
+
+    chunks = []
+    start = 0
+    # text[:counted] にある引用符の数（窓は前に進むだけなので差分だけ数える）
+    quotes = 0
+    counted = 0
+    while len(text) - start > target:
+        limit = min(start + target * MAX_CHUNK_FACTOR, len(text))
+        cut = None
+        pos = start + target
+        while cut is None and pos < limit:
+            lo = text.find(" ", max(start + 1, pos - CHUNK_WINDOW_CHARS // 2)) + 1
+            hi = min(pos + CHUNK_WINDOW_CHARS // 2, len(text))
+            if 0 < lo < hi:
+                if lo >= counted:
+                    quotes += text.count('"', counted, lo)
+                else:
+                    quotes -= text.count('"', lo, counted)
+                counted = lo
+                cut = find_sentence_start(text, nlp, lo, hi, pos, quotes)
+            pos = hi
+
+        if cut is not None:
+            chunks.append((text[start:cut - 1], True))
+            start = cut
+            continue
+
+        # 文境界が見つからない: 残りが収まるならそのまま、でなければ語の間で切る
+        cut = text.find(" ", limit) + 1
+        if limit >= len(text) or cut == 0:
+            break
+        chunks.append((text[start:cut - 1], False))
+        start = cut
+
+    chunks.append((text[start:], True))
+    return chunks
+
+
+def get_text_chunks(text: str, nlp: "spacy.Language") -> list[tuple[str, bool]]:
+    """
+    split_text_into_chunks の結果（分割位置）をテキストとパイプライン毎にキャッシュする
+
+    分割位置を選ぶには窓を解析する必要があるため、Doc がキャッシュ済みでも
+    毎回 nlp を通すことになる。分割位置も保存し、解析し直さずに済ませる。
+    """
+    if len(text) <= CHUNK_CHARS:
+        return [(text, True)]
+
+    params = f"{CHUNK_CHARS},{CHUNK_WINDOW_CHARS},{MAX_CHUNK_FACTOR}"
+    spans = cache.load_chunks(text, nlp, params)
+    if spans is not None:
+        return [(text[start:end], is_end) for start, end, is_end in spans]
+
+    chunks = split_text_into_chunks(text, nlp)
+    spans = []
+    offset = 0
+    for chunk, is_end in chunks:
+        spans.append((offset, offset + len(chunk), is_end))
+        # チャンク同士はスペース 1 つで区切られている
+        offset += len(chunk) + 1
+    cache.save_chunks(text, nlp, params, spans)
+    return chunks
+
+
+def join_docs(docs: list["Doc"], ends: list[bool]) -> "Doc":
+    """
+    チャンク毎の Doc を一つにつなぐ。語の間で切ったチャンクの後ろは文頭にしない
+    """
+    import numpy as np
+    from spacy.attrs import SENT_START
+    from spacy.tokens import Doc
+
+    doc = Doc.from_docs(docs, ensure_whitespace=True)
+    first = np.cumsum([len(d) for d in docs])[:-1]
+    cuts = [i for i, is_end in zip(first, ends) if not is_end and i < len(doc)]
+    if cuts:
+        # 解析済みの Doc には Token.is_sent_start を書けないため、配列で書き換える
+        sent_starts = doc.to_array([SENT_START]).astype(np.int64)
+        sent_starts[cuts] = -1
+        doc.from_array([SENT_START], sent_starts.astype(np.uint64))
+    return doc
+
+
+def get_nlp_processes(config, n_chunks: int) -> int:
+    n_process = config.get("nlp_jobs") or max(1, os.cpu_count() // 2)
+    return max(1, min(n_process, n_chunks))
+
+
+def analyze_text(nlp: "spacy.Language", text: str, config) -> "Doc":
+    """
+    長いテキストはチャンクに分けて nlp.pipe(n_process=N) で解析し、
+    join_docs で一つの Doc（トークン位置は通し番号）に戻す
+    """
+    chunks = get_text_chunks(text, nlp)
+    if len(chunks) == 1:
+        return nlp(text)
+
+    n_process = get_nlp_processes(config, len(chunks))
+    print("[cyan][INFO][/]", f"{len(chunks):,} chunks, {n_process:,} processes.")
+    docs = list(nlp.pipe((c for c, _ in chunks), n_process=n_process, batch_size=1))
+    return join_docs(docs, [is_end for _, is_end in chunks])
+
+
+def get_spacy_document(text: str, config) -> "Doc":
+    with profiler.span("load_pipeline"):
+        nlp = load_pipeline(config)
+
+    print("[cyan][INFO][/]", "Analyzing text...")
+    doc = cache.load_doc(text, nlp)
+    if doc is not None:
+        print("[cyan][INFO][/]", "Skipped. Cached spacy document found.")
+    else:
+        with Progress() as p, profiler.span("spacy", pipeline=",".join(nlp.pipe_names)):
+            p.add_task("", total=None)
+            doc = analyze_text(nlp, text, config)
+        cache.save_doc(text, nlp, doc)
+
+    export_spacy_document(doc, config)
 
-   
     return doc
 
+
+def iter_spacy_documents(text: str, config):
+    """
+    テキストをチャンク毎に解析し、(text 上の文字オフセット, Doc, 文末で終わるか) を順に yield する
+
+    Doc 全体を組み立てないため、同時に持つ Doc はチャンク 1 つ分（CHUNK_CHARS 程度）。
+    キャッシュもチャンク単位で読み書きする（1 チャンクならテキスト全体と同じキー）。
+    """
+    with profiler.span("load_pipeline"):
+        nlp = load_pipeline(config)
+    chunks = get_text_chunks(text, nlp)
+
+    print("[cyan][INFO][/]", "Analyzing text...")
+    hits = [os.path.exists(cache.get_doc_path(cache.get_doc_key(c, nlp))) for c, _ in chunks]
+    misses = [c for (c, _), hit in zip(chunks, hits) if not hit]
+    if len(chunks) > 1:
+        print("[cyan][INFO][/]", f"{len(chunks):,} chunks, {len(chunks) - len(misses):,} cached.")
+
+    n_process = get_nlp_processes(config, len(misses))
+    parsed = iter(nlp.pipe(misses, n_process=n_process, batch_size=1)) if misses else iter(())
+
+    offset = 0
+    for (chunk, is_end), hit in zip(chunks, hits):
+        doc = cache.load_doc(chunk, nlp) if hit else None
+        if doc is None:
+            with profiler.span("spacy", pipeline=",".join(nlp.pipe_names)):
+                # 壊れたキャッシュは読めないため、その場で解析し直す
+                doc = next(parsed) if not hit else nlp(chunk)
+            cache.save_doc(chunk, nlp, doc)
+        yield offset, doc, is_end
+        del doc
+        # チャンク同士はスペース 1 つで区切られている
+        offset += len(chunk) + 1
+
+
+def get_spacy_documents(items, batch_size: int = 4):
+    """
+    (text, config, context) の iterable を一つのパイプラインで解析し、
+    (doc, context) を逐次 yield する（順序は保証しない）
+    パイプラインは最初の config で選ぶ（バッチ内の設定は共通）
+    """
+    items = iter(items)
+    first = next(items, None)
+    if first is None:
+        return
+    items = itertools.chain([first], items)
+
+    nlp = load_pipeline(first[1])
+    cached = []
+
+    def _uncached():
+        for text, config, context in items:
+            doc = cache.load_doc(text, nlp)
+            if doc is not None:
+                print("[cyan][INFO][/]", f"Skipped. Cached spacy document found: {config.get('video_id')}")
+                export_spacy_document(doc, config)
+                cached.append((doc, context))
+                continue
+            yield text, (text, config, context)
+
+    docs = nlp.pipe(_uncached(), as_tuples=True, batch_size=batch_size)
+    for doc, (text, config, context) in docs:
+        while cached:
+            yield cached.pop(0)
+        cache.save_doc(text, nlp, doc)
+        export_spacy_document(doc, config)
+        yield doc, context
+
+    while cached:
+        yield cached.pop(0)
+
+
 def parse_time(srt_time: str) -> timedelta:
     """
     "HH:mm:ss.mmm" -> timedelta
@@ -90,45 +432,33 @@ def get_media_filename(video_id, start, end, ext):
     return f"y2a-{note_id}.{ext}"
 
 
-def write_in_vtt(file_path: str, segments: list[Segment]):
+def write_in_vtt(file_path: str, segments: Iterable["Segment"]):
     """
     vtt output
     """
-    output = [
-        "WEBVTT",
-        "Kind: captions",
-        "Language: en\n",
-    ]
-    for segment in segments:
-        start = segment.start
-        end = segment.end
-        sentence = segment.sentence
-        start_str = format_time(start, delim=":")
-        end_str = format_time(end, delim=":")
-        output.append(f"{start_str} --> {end_str}")
-        # output.append(f"{sentence}")
-        output.append(f"{sentence}\n")
-
     with open(file_path, "w", encoding="utf-8") as f:
-        for row in output:
-            f.write(row + "\n")
+        f.write("WEBVTT\nKind: captions\nLanguage: en\n\n")
+        for segment in segments:
+            start_str = format_time(segment.start, delim=":")
+            end_str = format_time(segment.end, delim=":")
+            f.write(f"{start_str} --> {end_str}\n")
+            f.write(f"{segment.sentence}\n\n")
 
     print("[cyan][INFO][/]", f"[green]File created: {file_path}")
 
 
-def write_in_txt(file_path: str, segments: list[Segment]):
+def write_in_txt(file_path: str, segments: Iterable["Segment"]):
     """
     txt output
     """
-    sents = [seg.sentence for seg in segments]
     with open(file_path, "w", encoding="utf-8") as f:
-        for s in sents:
-            f.write(s + "\n")
+        for seg in segments:
+            f.write(seg.sentence + "\n")
 
     print("[cyan][INFO][/]", f"[green]File created: {file_path}")
 
 
-def write_in_csv(file_path: str, rows: list[str]):
+def write_in_csv(file_path: str, rows: Iterable[list[str]]):
     """
     csv output
     """
@@ -140,17 +470,22 @@ def write_in_csv(file_path: str, rows: list[str]):
     print("[cyan][INFO][/]", f"[green]File created: {file_path}")
 
 
-def write_in_json(file_path: str, rows: list[str]):
+def write_in_json(file_path: str, rows: Iterable[dict]):
     """
-    json output
+    json output（json.dump(rows, indent=4) と同じ内容を一件ずつ書き出す）
     """
     with open(file_path, mode="w", encoding="utf-8") as f:
-        json.dump(rows, f, ensure_ascii=False, indent=4)
+        sep = "[\n"
+        for row in rows:
+            item = json.dumps(row, ensure_ascii=False, indent=4)
+            f.write(sep + "    " + item.replace("\n", "\n    "))
+            sep = ",\n"
+        f.write("[]" if sep == "[\n" else "\n]")
 
     print("[cyan][INFO][/]", f"[green]File created: {file_path}")
 
 
-def print_segment(segment: Segment):
+def print_segment(segment: "Segment"):
     print(
         "[magenta][VERBOSE][/]",
         segment.delta.total_seconds(), "seconds,",
@@ -159,7 +494,7 @@ def print_segment(segment: Segment):
     print("[magenta][VERBOSE][/]", segment.sentence)
 
 
-def print_longest_segment(segments: list[Segment]):
+def print_longest_segment(segments: list["Segment"]):
     time_wise = None
     word_wise = None
     max_duration = timedelta(seconds=0)
@@ -187,7 +522,7 @@ def print_longest_segment(segments: list[Segment]):
     print()
 
 
-def print_token_count(doc: Doc):
+def print_token_count(doc: "Doc"):
     tokens = [str(token) for token in doc if not token.is_space]
     lemmas = [token.lemma_.lower() for token in doc if token.is_alpha]
     
@@ -200,29 +535,33 @@ def print_token_count(doc: Doc):
     print()
 
 
-def print_summary(segments: list[Segment], config):
-    durations = [seg.delta for seg in segments]
-    
-    max_seconds = int(config.get("max_duration").total_seconds())
+def get_duration_histogram(segments: list["Segment"], max_seconds: int) -> tuple[list[int], int]:
+    """
+    1 秒刻みのセグメント数（~ 1 sec, ~ 2 sec, ...）と max_seconds を超えた数
+    """
     duration_counts = [0 for _ in range(max_seconds)]
     over_max_sec = 0
-    
-    for d in durations:
-        found = False
-        for i in range(len(duration_counts)):
-            if d <= timedelta(seconds=i+1):
-                duration_counts[i] += 1
-                found = True
-                break
-        if not found:
+
+    for seg in segments:
+        # d <= i + 1 秒となる最小の i
+        i = max(0, -(-(seg.end_ms - seg.start_ms) // 1000) - 1)
+        if i < max_seconds:
+            duration_counts[i] += 1
+        else:
             over_max_sec += 1
 
+    return duration_counts, over_max_sec
+
+
+def print_summary(segments: list["Segment"], config):
+    max_seconds = int(config.get("max_duration").total_seconds())
+    duration_counts, over_max_sec = get_duration_histogram(segments, max_seconds)
+
     print()
     for i, d in enumerate(duration_counts):
         print("[magenta][VERBOSE][/]", f"~ {i+1} sec: {d:,} segments")
     print("[magenta][VERBOSE][/]", f"{max_seconds} sec ~: {over_max_sec:,} segments")
 
-    total = sum(durations, timedelta())
+    total = sum((seg.delta for seg in segments), timedelta())
     print()
     print("[magenta][VERBOSE][/]", f"{format_time(total, delim=':')} in total.")
-    
\ No newline at end of file
@@ -0,0 +1,110 @@
+from importlib.util import find_spec
+
+import numpy as np
+import pytest
+
+from y2a import utils
+from y2a.splitter import (
+    collect_boundary_chars,
+    get_boundary_chars,
+    get_doc_boundaries,
+    get_doc_spans,
+    get_sentence_boundaries,
+    iter_chunk_spans,
+)
+
+CONFIG = {
+    "boundaries": ("sentence",),
+    "formats": (),
+    "min_words": 3,
+    "nlp_jobs": 1,
+}
+
+
+def make_text() -> str:
+    """
+    略語（Dr. / U.S.）、引用符、句読点のない長い区間を含む文字起こし
+    """
+    sentences = [
+        "Dr. Smith went to the U.S. last year with his family.",
+        '"Are you sure about that?" she asked him again.',
+        "We spent a lot of time there, and it was really good.",
+        "Mr. Brown said the meeting starts at 5 p.m. on Friday.",
+        "I think people just want to know what happened next.",
+    ]
+    parts = sentences * 6
+    # 句読点がなく、文境界が見つからない区間（語の間で切られる）
+    parts.insert(12, " ".join(["and then we just kept going"] * 60))
+    return " ".join(parts)
+
+
+@pytest.fixture
+def small_chunks(monkeypatch, tmp_path):
+    monkeypatch.setenv("Y2A_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(utils, "CHUNK_CHARS", 300)
+    monkeypatch.setattr(utils, "CHUNK_WINDOW_CHARS", 200)
+
+
+def whole_sentence_chars(doc) -> np.ndarray:
+    return np.unique(get_boundary_chars(doc, get_sentence_boundaries(doc)))
+
+
+def test_chunks_cover_text_and_cut_at_sentences(small_chunks):
+    nlp = utils.load_pipeline(CONFIG)
+    text = make_text()
+
+    chunks = utils.split_text_into_chunks(text, nlp)
+
+    assert len(chunks) > 2
+    assert " ".join(c for c, _ in chunks) == text
+    assert not all(is_end for _, is_end in chunks)
+    # 略語の直後では切らない
+    for chunk, is_end in chunks[:-1]:
+        if is_end:
+            assert not chunk.endswith(("Dr.", "U.S.", "Mr.", "p.m."))
+
+
+def test_chunk_offsets_are_cached(small_chunks, monkeypatch):
+    nlp = utils.load_pipeline(CONFIG)
+    text = make_text()
+    chunks = utils.get_text_chunks(text, nlp)
+    assert chunks == utils.split_text_into_chunks(text, nlp)
+
+    # 2 回目は分割位置を選び直さない（窓を解析しない）
+    def fail(*args, **kwargs):
+        raise AssertionError("the windows were parsed again")
+
+    monkeypatch.setattr(utils, "find_sentence_start", fail)
+    assert utils.get_text_chunks(text, nlp) == chunks
+
+
+def test_chunked_boundaries_match_whole_document(small_chunks):
+    nlp = utils.load_pipeline(CONFIG)
+    text = make_text()
+    whole = nlp(text)
+
+    sentence_chars, _ = collect_boundary_chars(utils.iter_spacy_documents(text, CONFIG), CONFIG)
+    # 最後のチャンクの終端（テキストの末尾）は境界ではない
+    chunked = np.unique(sentence_chars[sentence_chars < len(text)])
+    assert chunked.tolist() == whole_sentence_chars(whole).tolist()
+
+    spans = [s for batch in iter_chunk_spans(utils.iter_spacy_documents(text, CONFIG), CONFIG) for s in batch]
+    assert spans == get_doc_spans(whole, *get_doc_boundaries(whole, CONFIG), CONFIG["min_words"])
+
+    joined = utils.analyze_text(nlp, text, CONFIG)
+    assert whole_sentence_chars(joined).tolist() == whole_sentence_chars(whole).tolist()
+
+
+@pytest.mark.skipif(find_spec(utils.MODEL_NAME) is None, reason=f"{utils.MODEL_NAME} is not installed")
+def test_cuts_are_sentence_boundaries_of_full_model(small_chunks):
+    config = {**CONFIG, "boundaries": ("sentence", "grammar")}
+    nlp = utils.load_pipeline(config)
+    text = make_text()
+    whole_chars = set(whole_sentence_chars(nlp(text)).tolist())
+
+    offset = 0
+    for chunk, is_end in utils.split_text_into_chunks(text, nlp)[:-1]:
+        offset += len(chunk)
+        if is_end:
+            assert offset in whole_chars
+        offset += 1
@@ -0,0 +1,17 @@
+from y2a.bench import IMPORT_BUDGET_MS, LAZY_MODULES, measure_import_time
+
+
+def test_cli_import_time_within_budget():
+    # 1 回目は .pyc の生成を含むため、2 回目の値で判定する
+    measure_import_time("y2a.cli")
+    times = measure_import_time("y2a.cli")
+
+    assert "y2a.cli" in times
+    assert times["y2a.cli"] / 1000 <= IMPORT_BUDGET_MS
+
+
+def test_cli_does_not_import_heavy_modules():
+    times = measure_import_time("y2a.cli")
+
+    eager = [m for m in LAZY_MODULES if m in times]
+    assert not eager, f"imported at startup: {', '.join(eager)}"
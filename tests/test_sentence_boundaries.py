@@ -0,0 +1,31 @@
+import os
+from importlib.util import find_spec
+
+import pytest
+
+from y2a.bench import SENTENCE_RECALL_MIN, get_sentence_ends
+from y2a.parser import parse_into_word_store
+from y2a.utils import MODEL_NAME, SENTENCIZER, load_pipeline, load_spacy
+
+SUBTITLE_PATH = os.path.join(os.path.dirname(__file__), "data", "sample.en-orig.srv2")
+
+# 文境界だけが必要な設定（高速モード）
+FAST_CONFIG = {"boundaries": ("sentence", "speech"), "formats": ()}
+
+
+def test_fast_pipeline_skips_the_model():
+    nlp = load_pipeline(FAST_CONFIG)
+
+    assert nlp.pipe_names == [SENTENCIZER]
+
+
+@pytest.mark.skipif(find_spec(MODEL_NAME) is None, reason=f"{MODEL_NAME} is not installed")
+def test_fast_pipeline_matches_full_model():
+    text = parse_into_word_store(SUBTITLE_PATH).text
+
+    fast_ends = get_sentence_ends(load_pipeline(FAST_CONFIG)(text))
+    full_ends = get_sentence_ends(load_spacy(MODEL_NAME)(text))
+
+    assert full_ends
+    recall = len(fast_ends & full_ends) / len(full_ends)
+    assert recall >= SENTENCE_RECALL_MIN